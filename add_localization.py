@@ -11,12 +11,18 @@
 
 import os
 import argparse
+import functools
 from typing import List, Tuple
 from dataclasses import dataclass
 from pathlib import Path
 import time
-from chat_gpt_interface import ChatGPT
-from common import get_openapi_token, add_common_args, user_approved_overwrite_warning, file_has_uncommitted_changes
+from chat_gpt_interface import ChatGPT, HedgingPolicy
+from retry_policy import RetryPolicy
+from tracing import span, profiling
+from few_shot import Example, ExampleIndex, load_examples, estimate_tokens
+from prescan import find_files_with_candidates
+from transport import create_transport
+from common import L10nError, get_openapi_token, add_common_args, user_approved_overwrite_warning, file_has_uncommitted_changes, log_to_stdout
 
 
 task_desc_intro = """
@@ -51,6 +57,11 @@ Second, the same file, but with the required changes already applied.
 Third, a file without the calls to the `String` initializer where it's your task to make those modifications and to return the whole file modified.
 """
 
+task_desc_end_examples = """
+You will first be given a few short examples. Each one consists of a snippet that has not been adapted with the string constructors, followed by the same snippet with the required changes applied.
+Then you will be given a file without the calls to the `String` initializer where it's your task to make those modifications and to return the whole file modified.
+"""
+
 # Reference files
 SCRIPT_FOLDER_PATH = os.path.dirname(os.path.realpath(__file__))
 non_localized_file = os.path.join(SCRIPT_FOLDER_PATH, "reference/PinEntryView_not-localized.swift")
@@ -62,28 +73,75 @@ def generate_swift_localization_command(input_swift_file, force_single_line = Fa
     force_single_line: Will ensure the content keeps the same number of lines.
     """
 
+    with open(input_swift_file, "r") as f:
+        swift_source = f.read()
+
+    return build_swift_localization_command(swift_source, force_single_line)
+
+
+@functools.lru_cache(maxsize=None)
+def read_reference_pair() -> Tuple[str, str]:
+    """
+    Returns the contents of the non-localized and localized reference file.
+    Read only once per run.
+    """
+    with span("read_reference_files"):
+        with open(non_localized_file, "r") as f:
+            non_localized = f.read()
+        with open(localized_file, "r") as f:
+            localized = f.read()
+    return non_localized, localized
+
+
+@functools.lru_cache(maxsize=None)
+def build_system_command_prefix(force_single_line: bool, with_examples: bool) -> str:
+    """
+    The static part of the system command. Built once per run so that every
+    request starts with the same bytes. Anything that changes per file must
+    come after it.
+
+    Providers only cache prompt prefixes above a minimum length (1024 tokens
+    for OpenAI). Only the prefix with the full reference pair is long enough,
+    the one for few-shot examples is about 350 tokens.
+    """
+
     # models: https://platform.openai.com/docs/models/gpt-3-5
     # token count = number of words + number of dots, commas and so on
 
     line_handling = task_desc_singleline if force_single_line else task_desc_multiline
-    system_command = task_desc_intro + line_handling + task_desc_end + "\n"
 
-    system_command += "First, a file without the modifications:\n\n"
+    if with_examples:
+        return task_desc_intro + line_handling + task_desc_end_examples + "\n"
 
-    with open(non_localized_file, "r") as f:
-        system_command += f.read()
+    non_localized, localized = read_reference_pair()
 
+    system_command = task_desc_intro + line_handling + task_desc_end + "\n"
+    system_command += "First, a file without the modifications:\n\n"
+    system_command += non_localized
     system_command += "\n\n\n" + "Now the same file, but with the required changes already applied:\n\n"
+    system_command += localized
+    system_command += "\n\n\n" + "Now the last file, for which you should make those changes and respond with the while file in updated form."
+    return system_command
 
-    with open(localized_file, "r") as f:
-        system_command += f.read()
 
-    system_command += "\n\n\n" + "Now the last file, for which you should make those changes and respond with the while file in updated form."
-    
-    with open(input_swift_file, "r") as f:
-        user_input = f.read()
-    
-    return system_command, user_input
+def build_swift_localization_command(swift_source: str, force_single_line = False, examples: List[Example] = None) -> Tuple[str, str]:
+    """
+    Returns the system command and user input to localize the given Swift source.
+
+    force_single_line: Will ensure the content keeps the same number of lines.
+    examples: Few-shot examples to use instead of the full reference pair.
+    """
+
+    system_command = build_system_command_prefix(force_single_line, examples is not None)
+    if examples is None:
+        return system_command, swift_source
+
+    # Sorted by name, so that files with the same examples share the same prefix
+    for i, example in enumerate(sorted(examples, key=lambda e: e.name)):
+        system_command += f"Example {i+1} without the modifications:\n\n{example.not_localized}\n\n"
+        system_command += f"Example {i+1} with the required changes applied:\n\n{example.localized_for(force_single_line)}\n\n\n"
+    system_command += "Now the file for which you should make those changes and respond with the whole file in updated form."
+    return system_command, swift_source
 
 
 @dataclass
@@ -92,6 +150,18 @@ class AddL10nConfig:
     openai_api_cooldown: int
     single_line_modifications: bool
     log_path: str
+    profile: bool = False
+    profile_cprofile: bool = False
+    hedge_percentile: float = None
+    hedge_max_ratio: float = 0.1
+    max_retries: int = 6
+    full_reference: bool = False
+    example_token_budget: int = 1500
+    prescan: bool = True
+    # Responses are recorded to or replayed from these files, see transport.py
+    record_path: str = None
+    replay_path: str = None
+    replay_fall_through: bool = False
 
 
 def _parse_args() -> AddL10nConfig:
@@ -106,6 +176,9 @@ def _parse_args() -> AddL10nConfig:
     parser.add_argument("paths", nargs="+", help="Either provide multiple paths of .swift files. Or provide a single path to a folder to process all .swift files found in that folder.")
     parser.add_argument("--output", type=str, help="Optional output folder. The localized files will be written to this location. If not specified, will overwrite input.")
     parser.add_argument("--single-line-modifications", action="store_true", help="If this optional flag is set, the resulting String(..) constructors will be done in place for the existing strings, not adding any new variables or line breaks.")
+    parser.add_argument("--full-reference", action="store_true", help="Send the full PinEntryView reference pair with every file instead of a few matching examples from reference/examples.")
+    parser.add_argument("--example-token-budget", type=int, default=1500, help="Maximum number of tokens used for the few-shot examples of each file. Ignored with --full-reference.")
+    parser.add_argument("--no-prescan", action="store_true", help="Send every file to ChatGPT, even if no UI strings were found in it locally.")
     add_common_args(parser)
 
     args = parser.parse_args()
@@ -176,7 +249,18 @@ def _parse_args() -> AddL10nConfig:
         localization_pairs = localization_pairs,
         openai_api_cooldown = args.openai_api_cooldown,
         single_line_modifications = args.single_line_modifications,
-        log_path = args.log_path
+        log_path = args.log_path,
+        profile = args.profile,
+        profile_cprofile = args.profile_cprofile,
+        hedge_percentile = args.hedge_percentile,
+        hedge_max_ratio = args.hedge_max_ratio,
+        max_retries = args.max_retries,
+        full_reference = args.full_reference,
+        example_token_budget = args.example_token_budget,
+        prescan = not args.no_prescan,
+        record_path = args.record,
+        replay_path = args.replay,
+        replay_fall_through = args.replay_fall_through
     )
 
     return user_conf
@@ -193,33 +277,103 @@ def remove_markdown_code_block_annotation(file_contents: str) -> str:
     
     return "\n".join(lines)
 
+
+def skip_files_without_candidates(localization_pairs: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    """
+    Drops the pairs whose input file has no strings that need to be localized,
+    see prescan.has_localizable_candidates.
+    """
+    with span("prescan", files=len(localization_pairs)) as prescan_span:
+        has_candidates = find_files_with_candidates(input_path for input_path, _ in localization_pairs)
+        remaining_pairs = [pair for pair, keep in zip(localization_pairs, has_candidates) if keep]
+        prescan_span.annotate(skipped=len(localization_pairs) - len(remaining_pairs))
+
+    skipped = len(localization_pairs) - len(remaining_pairs)
+    if skipped:
+        print(f"Skipping {skipped} of {len(localization_pairs)} files without UI strings.")
+    return remaining_pairs
+
+
+def build_example_index(token_budget: int = 1500) -> ExampleIndex:
+    """
+    Indexes the few-shot examples in reference/examples.
+    """
+    non_localized, localized = read_reference_pair()
+    reference_tokens = estimate_tokens(non_localized) + estimate_tokens(localized)
+
+    return ExampleIndex(load_examples(), token_budget=token_budget, reference_tokens=reference_tokens)
+
+
+def localize_swift_source(cpt: ChatGPT, swift_source: str, force_single_line = False, example_index: ExampleIndex = None) -> str:
+    """
+    Returns the given Swift source with the UI strings replaced by
+    String(localized:comment:) constructors.
+
+    example_index: If given, the most relevant few-shot examples are sent
+        instead of the full reference pair.
+    """
+    with span("build_prompt") as prompt_span:
+        examples = None
+        if example_index is not None:
+            examples = example_index.select(swift_source)
+            prompt_span.annotate(examples=[e.name for e in examples], example_tokens=sum(e.tokens for e in examples))
+        system_command, user_input = build_swift_localization_command(swift_source, force_single_line, examples)
+    rewrite = cpt.complete_query(system_command, user_input)
+
+    return remove_markdown_code_block_annotation(rewrite)
+
     
 def main():
 
+    log_to_stdout()
     user_config = _parse_args()
     localization_pairs = user_config.localization_pairs
 
-    openai_api_token = get_openapi_token()
+    try:
+        transport = create_transport(user_config.record_path, user_config.replay_path, user_config.replay_fall_through)
+    except L10nError as e:
+        print(e.message)
+        print("Aborting.")
+        exit(1)
+
+    openai_api_token = get_openapi_token(required=transport is None or not transport.is_offline)
     
     # Need to use new model with large token count
-    cpt = ChatGPT(openai_api_token, model="gpt-4o", log_path=user_config.log_path)
+    hedging = HedgingPolicy(user_config.hedge_percentile, user_config.hedge_max_ratio) if user_config.hedge_percentile else None
+    cpt = ChatGPT(openai_api_token, model="gpt-4o", log_path=user_config.log_path, hedging=hedging,
+                  retry_policy=RetryPolicy(max_retries=user_config.max_retries), transport=transport)
+
+    example_index = None if user_config.full_reference else build_example_index(user_config.example_token_budget)
+
+    with profiling(user_config.profile, user_config.log_path, user_config.profile_cprofile):
+        if user_config.prescan:
+            localization_pairs = skip_files_without_candidates(localization_pairs)
+
+        for i, (input_file_path, output_file_path) in enumerate(localization_pairs):
 
-    for i, (input_file_path, output_file_path) in enumerate(localization_pairs):
+            print(f"Generating localized version for:\n  {input_file_path}")
+            if input_file_path == output_file_path:
+                print(f"  Result will overwrite input")
+            else:
+                print(f"  Result will be written to:\n  {output_file_path}")
 
-        print(f"Generating localized version for:\n  {input_file_path}")
-        if input_file_path == output_file_path:
-            print(f"  Result will overwrite input")
-        else:
-            print(f"  Result will be written to:\n  {output_file_path}")
+            with span("localize_file", file=input_file_path):
+                with open(input_file_path, "r") as f:
+                    swift_source = f.read()
 
-        system_command, user_input = generate_swift_localization_command(input_file_path, user_config.single_line_modifications)
-        rewrite = cpt.complete_query(system_command, user_input)
+                rewrite = localize_swift_source(cpt, swift_source, user_config.single_line_modifications, example_index)
 
-        rewrite = remove_markdown_code_block_annotation(rewrite)
+                with span("write_output"):
+                    os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
+                    with open(output_file_path, "w") as f:
+                        f.write(rewrite)
 
-        os.makedirs(os.path.dirname(output_file_path), exist_ok=True)
-        with open(output_file_path, "w") as f:
-            f.write(rewrite)
+    if example_index is not None:
+        print(example_index.savings.summary())
+    print("Usage: " + cpt.usage.summary())
+    if transport is not None:
+        print(transport.summary())
+        transport.close()
         
 
 if __name__ == "__main__":
@@ -8,36 +8,443 @@
 
 
 import os
+import math
 import time
 import openai
 import datetime
 import json
-from typing import Callable
+import hashlib
+import logging
+import threading
+import collections
+from concurrent.futures import Future, wait, FIRST_COMPLETED
+from dataclasses import dataclass
+from typing import Callable, Dict
+from tracing import span
+from retry_policy import RetryPolicy, CircuitBreaker, is_retryable, server_retry_hint
+from transport import RecordReplayTransport
 
 
 SCRIPT_FOLDER_PATH = os.path.dirname(os.path.realpath(__file__))
 
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class HedgingPolicy:
+    """
+    If a request takes longer than the given latency percentile of the recent
+    requests, a duplicate request is sent and whichever valid response arrives
+    first is used.
+    """
+    # Latency percentile (0..1) after which a duplicate request is sent.
+    percentile: float = 0.95
+    # At most this fraction of all requests may be hedged to cap token usage.
+    max_hedge_ratio: float = 0.1
+    # Number of recent latencies that are used to estimate the percentile.
+    window: int = 50
+    # No hedging until this many latencies were observed.
+    min_samples: int = 10
+
+
+class RateLimiter:
+    """
+    Enforces a minimum time between two requests. Can be shared between
+    threads and ChatGPT instances so that all of them stay below one limit.
+    """
+
+    def __init__(self, cooldown_duration_sec: float):
+        self._cooldown_duration_sec = cooldown_duration_sec
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def wait(self, deadline: float = None) -> bool:
+        """
+        Sleeps until the next request may be sent. Returns False right away,
+        without taking the slot, if that would be after deadline (time.time()).
+        """
+        with self._lock:
+            now = time.time()
+            slot = max(now, self._next_slot)
+            if deadline is not None and slot >= deadline:
+                return False
+            self._next_slot = slot + self._cooldown_duration_sec
+
+        delay = slot - now
+        if delay > 0:
+            logger.info(f"  -- going to sleep for {delay:.0f} secs to not exceed openai rate limit --")
+            with span("rate_limit_sleep"):
+                time.sleep(delay)
+        return True
+
+    def try_acquire(self) -> bool:
+        """
+        Takes the slot if a request may be sent right now. Never sleeps.
+        """
+        with self._lock:
+            now = time.time()
+            if self._next_slot > now:
+                return False
+            self._next_slot = now + self._cooldown_duration_sec
+        return True
+
+
+@dataclass
+class UsageStats:
+    requests: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    # Prompt tokens that were served from the provider's prompt cache
+    cached_tokens: int = 0
+    # Responses that were replayed from a RecordReplayTransport. They are not
+    # counted as requests and tokens.
+    replayed: int = 0
+
+    @property
+    def total_tokens(self) -> int:
+        return self.prompt_tokens + self.completion_tokens
+
+    @property
+    def cache_hit_ratio(self) -> float:
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def summary(self) -> str:
+        summary = f"{self.requests} requests, {self.prompt_tokens} prompt tokens " \
+            f"({self.cached_tokens} cached, {100 * self.cache_hit_ratio:.0f}% cache hits), {self.completion_tokens} completion tokens"
+        if self.replayed:
+            summary += f", {self.replayed} replayed responses"
+        return summary
+
+
+class ResponseCache:
+    """
+    Keeps the responses of the last max_entries distinct queries, the least
+    recently used one is dropped first. Can be shared between threads.
+    """
+
+    def __init__(self, max_entries: int = 1000):
+        self.max_entries = max_entries
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> str:
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def __setitem__(self, key: str, value: str):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class BudgetExhaustedError(RuntimeError):
+    pass
+
+
+class DeadlineExceededError(RuntimeError):
+    pass
+
+
+class UsageBudget:
+    """
+    Upper limit for the requests and tokens of all ChatGPT instances sharing
+    it. Once exhausted, further queries raise BudgetExhaustedError. Requests
+    that are already running are not interrupted, so the limit can be exceeded
+    by the size of those.
+    """
+
+    def __init__(self, max_requests: int = None, max_tokens: int = None):
+        self.max_requests = max_requests
+        self.max_tokens = max_tokens
+        self.used = UsageStats()
+        self._lock = threading.Lock()
+
+    def charge(self, prompt_tokens: int, completion_tokens: int):
+        with self._lock:
+            self.used.requests += 1
+            self.used.prompt_tokens += prompt_tokens
+            self.used.completion_tokens += completion_tokens
+
+    def is_exhausted(self) -> bool:
+        with self._lock:
+            if self.max_requests is not None and self.used.requests >= self.max_requests:
+                return True
+            if self.max_tokens is not None and self.used.total_tokens >= self.max_tokens:
+                return True
+            return False
+
+
+def _run_in_daemon_thread(fn: Callable, *args) -> Future:
+    """
+    Like ThreadPoolExecutor.submit, but with a daemon thread so that a request
+    that lost the race does not keep the interpreter from exiting.
+    """
+    future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(fn(*args))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name="openai-request", daemon=True).start()
+    return future
+
 
 class ChatGPT:
 
-    def __init__(self, openai_token: str = None, model: str = "gpt-4", log_path: str = "queries", cooldown_duration_sec: int = 2):
+    def __init__(self, openai_token: str = None, model: str = "gpt-4", log_path: str = "queries", cooldown_duration_sec: int = 2, hedging: HedgingPolicy = None,
+                 retry_policy: RetryPolicy = None, circuit_breaker: CircuitBreaker = None, response_cache: Dict[str, str] = None,
+                 rate_limiter: RateLimiter = None, budget: UsageBudget = None, transport: RecordReplayTransport = None):
+        """
+        log_path: Folder for the query logs. Logging is disabled if None.
+        circuit_breaker: Can be shared between several instances so that all of
+            them pause together when the API is unavailable.
+        rate_limiter: Can be shared between several instances so that all of
+            them stay below one rate limit. Otherwise, one is created using
+            cooldown_duration_sec.
+        budget: Optional limit for requests and tokens, can be shared as well.
+        response_cache: Optional dict or ResponseCache in which valid responses
+            are kept. Identical queries are answered from it without contacting
+            the API.
+        transport: Optional RecordReplayTransport to record the responses or to
+            replay them offline. No API key is needed if it never falls
+            through to the API.
+        """
         if not openai_token:
             openai_token = os.getenv("OPENAI_API_KEY")
-        
+
+        if not openai_token and transport is not None and transport.is_offline:
+            # The client is never used
+            openai_token = "offline"
+
         if not openai_token:
             raise RuntimeError("An OpenAI API key is required, either as a constructor argument or in the 'OPENAI_API_KEY' environment variable.")
         
         self.model = model
-        self.client = openai.OpenAI(api_key=openai_token)
+        # Retries are handled by self._retry_policy instead of the client
+        self.client = openai.OpenAI(api_key=openai_token, max_retries=0)
 
-        self._queries_folder_path = log_path if os.path.isabs(log_path) else os.path.abspath(log_path)
-        os.makedirs(self._queries_folder_path, exist_ok=True)
+        self._queries_folder_path = None
+        if log_path is not None:
+            self._queries_folder_path = log_path if os.path.isabs(log_path) else os.path.abspath(log_path)
+            os.makedirs(self._queries_folder_path, exist_ok=True)
 
-        self._cooldown_duration_sec = cooldown_duration_sec
-        self._last_query_timestamp = 0
+        self._response_cache = response_cache
+        self._transport = transport
+
+        self._rate_limiter = rate_limiter or RateLimiter(cooldown_duration_sec)
+        self._budget = budget
+        self.usage = UsageStats()
+
+        self._hedging = hedging
+        self._stats_lock = threading.Lock()
+        self._latencies = collections.deque(maxlen=hedging.window if hedging else 1)
+        self._request_count = 0
+        self._hedge_count = 0
+
+        self._retry_policy = retry_policy or RetryPolicy()
+        self._circuit_breaker = circuit_breaker or CircuitBreaker()
+
+
+    @staticmethod
+    def _usage_numbers(usage):
+        """
+        Returns (prompt_tokens, completion_tokens, cached_tokens) of a response's usage.
+        """
+        prompt_tokens = usage.prompt_tokens if usage else 0
+        completion_tokens = usage.completion_tokens if usage else 0
+        details = getattr(usage, "prompt_tokens_details", None)
+        cached_tokens = (getattr(details, "cached_tokens", None) or 0) if details else 0
+        return prompt_tokens, completion_tokens, cached_tokens
+
+
+    def _record_usage(self, usage):
+        """
+        Adds the usage of a response to self.usage and the budget.
+        """
+        prompt_tokens, completion_tokens, cached_tokens = self._usage_numbers(usage)
+        with self._stats_lock:
+            self.usage.requests += 1
+            self.usage.prompt_tokens += prompt_tokens
+            self.usage.completion_tokens += completion_tokens
+            self.usage.cached_tokens += cached_tokens
+        if self._budget is not None:
+            self._budget.charge(prompt_tokens, completion_tokens)
+
+
+    def _write_log(self, date_str: str, suffix: str, content: str):
+        if self._queries_folder_path is None:
+            return
+        with span("write_query_logs"):
+            with open(os.path.join(self._queries_folder_path, f"{date_str}_{suffix}"), "w") as f:
+                f.write(content)
+
+
+    def _cache_key(self, system_command: str, user_input: str) -> str:
+        sha = hashlib.sha256()
+        for part in (self.model, system_command, user_input):
+            sha.update(part.encode("utf-8"))
+            sha.update(b"\0")
+        return sha.hexdigest()
+
+
+    def _request_completion(self, messages):
+        """
+        Sends one request. Its tokens are charged as soon as it returns, also
+        if it is a hedged request whose response is not used.
+        """
+        start = time.perf_counter()
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=messages
+        )
+        with self._stats_lock:
+            self._latencies.append(time.perf_counter() - start)
+        self._record_usage(response.usage)
+        return response
+
+
+    @staticmethod
+    def _is_valid_response(response, is_valid_callback: Callable[[str], bool] = None) -> bool:
+        if not response.choices or response.choices[0].finish_reason != "stop":
+            return False
+        content = response.choices[0].message.content
+        if content is None:
+            return False
+        return is_valid_callback is None or is_valid_callback(content.strip())
+
+
+    def _hedge_delay(self) -> float:
+        """
+        Returns the time after which a request should be hedged or None if it
+        should not be hedged, either because there is not enough data yet or
+        because the hedge budget is used up.
+        """
+        with self._stats_lock:
+            if self._hedging is None or len(self._latencies) < self._hedging.min_samples:
+                return None
+            if self._hedge_count + 1 > self._hedging.max_hedge_ratio * self._request_count:
+                return None
+            latencies = sorted(self._latencies)
+
+        index = min(len(latencies) - 1, max(0, math.ceil(self._hedging.percentile * len(latencies)) - 1))
+        return latencies[index]
+
+
+    def _create_completion(self, messages, is_valid_callback: Callable[[str], bool] = None):
+        """
+        Sends the request. With a HedgingPolicy, a duplicate is sent if the
+        request is slower than usual. The first valid response (finished with
+        reason "stop" and accepted by is_valid_callback) wins. A request that
+        already runs cannot be interrupted with the synchronous client, so the
+        losing response is discarded, but its tokens are still charged.
+
+        The duplicate is only sent if the budget is not used up and the rate
+        limiter has a free slot right now. Waiting for a slot would delay the
+        primary response, so the request is not hedged otherwise.
+        """
+        with self._stats_lock:
+            self._request_count += 1
 
+        hedge_delay = self._hedge_delay()
+        if hedge_delay is None:
+            return self._request_completion(messages)
 
-    def complete_query(self, system_command: str, user_input: str, is_valid_callback: Callable[[str], bool] = None, max_attempts: int = 2) -> str:
+        primary = _run_in_daemon_thread(self._request_completion, messages)
+        done, _ = wait([primary], timeout=hedge_delay)
+        if done:
+            return primary.result()
+
+        if self._budget is not None and self._budget.is_exhausted():
+            return primary.result()
+
+        if not self._rate_limiter.try_acquire():
+            return primary.result()
+
+        with self._stats_lock:
+            self._hedge_count += 1
+        logger.info(f"  -- request is slower than {hedge_delay:.1f} secs, sending a hedged duplicate --")
+
+        with span("hedged_request", hedge_delay=hedge_delay):
+            pending = {primary, _run_in_daemon_thread(self._request_completion, messages)}
+            fallback_response = None
+            first_error = None
+
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is not None:
+                        first_error = first_error or future.exception()
+                        continue
+                    response = future.result()
+                    if self._is_valid_response(response, is_valid_callback):
+                        for loser in pending:
+                            loser.cancel()
+                        return response
+                    fallback_response = fallback_response or response
+
+        # Neither request was valid. Let the caller deal with the response.
+        if fallback_response is not None:
+            return fallback_response
+        raise first_error
+
+
+    def _create_completion_with_retries(self, messages, is_valid_callback: Callable[[str], bool] = None, deadline: float = None):
+        """
+        Retries transient API failures with exponential backoff. Fatal errors
+        and the error of the last retry are raised to the caller.
+
+        Retries go through the rate limiter like every other request. No
+        retry is made once the budget is used up or if the backoff or the rate
+        limit would end after deadline (time.time()). BudgetExhaustedError or
+        DeadlineExceededError is raised instead.
+        """
+        for retry_idx in range(self._retry_policy.max_retries + 1):
+            self._circuit_breaker.wait_until_closed()
+
+            try:
+                response = self._create_completion(messages, is_valid_callback)
+            except Exception as e:
+                if not is_retryable(e):
+                    # The API is reachable, so this does not count as an outage
+                    self._circuit_breaker.record_success()
+                    raise
+
+                retry_hint = server_retry_hint(e)
+                self._circuit_breaker.record_failure(retry_hint)
+                if retry_idx == self._retry_policy.max_retries:
+                    raise
+
+                delay = self._retry_policy.backoff_delay(retry_idx, retry_hint)
+                if self._budget is not None and self._budget.is_exhausted():
+                    raise BudgetExhaustedError("The request or token budget is used up.") from e
+                if deadline is not None and time.time() + delay >= deadline:
+                    raise DeadlineExceededError("The deadline passes before the request could be retried.") from e
+
+                logger.warning(f"  -- request failed with {type(e).__name__}, retrying in {delay:.1f} secs --")
+                with span("retry_backoff", error=type(e).__name__, retry=retry_idx):
+                    time.sleep(delay)
+                if not self._rate_limiter.wait(deadline):
+                    raise DeadlineExceededError("The deadline passed before the request could be retried.") from e
+                continue
+
+            self._circuit_breaker.record_success()
+            return response
+
+
+    def complete_query(self, system_command: str, user_input: str, is_valid_callback: Callable[[str], bool] = None, max_attempts: int = 2,
+                       deadline: float = None) -> str:
         """
         Method takes a system_command and user_input and prompts ChatGPT for a
         response. Response is checked in several ways to make sure it's valid.
@@ -48,34 +455,54 @@ class ChatGPT:
         user_input: Data or anyting else provided by the user.
         is_valid_callback: a function that takes the response_text and checks whether it is valid before returning.
         max_attempts: Maximum number of attempts for getting a valid response.
+        deadline: Optional time.time() after which no request is sent anymore.
+            DeadlineExceededError is raised instead, also if the request would
+            have to wait for the rate limit or the backoff of a retry until
+            after the deadline.
         """
 
+        if self._response_cache is not None:
+            cache_key = self._cache_key(system_command, user_input)
+            cached_response = self._response_cache.get(cache_key)
+            if cached_response is not None:
+                return cached_response
+
         # https://platform.openai.com/docs/guides/chat/chat-vs-completions
         messages = [
           {"role": "system", "content": system_command},
           {"role": "user", "content": user_input}
         ]
 
-        for _ in range(max_attempts):
+        for attempt in range(max_attempts):
+
+            replayed_response = self._transport.replay(self.model, messages) if self._transport is not None else None
 
-            ts = time.time()
-            if ts - self._last_query_timestamp < self._cooldown_duration_sec:
-                time.sleep(self._cooldown_duration_sec - (ts - self._last_query_timestamp))
-                print(f"  -- going to sleep for {self._cooldown_duration_sec} secs to not exceed openai rate limit --")
-            self._last_query_timestamp = ts
+            if replayed_response is None:
+                if self._budget is not None and self._budget.is_exhausted():
+                    raise BudgetExhaustedError("The request or token budget is used up.")
 
-            date_str = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-            with open(os.path.join(self._queries_folder_path, f"{date_str}_1_system-input.txt"), "w") as f:
-                f.write(system_command)
-            with open(os.path.join(self._queries_folder_path, f"{date_str}_2_user-input.txt"), "w") as f:
-                f.write(user_input)
+                if not self._rate_limiter.wait(deadline):
+                    raise DeadlineExceededError("The deadline passed before the request could be sent.")
+
+            # Microseconds keep the log files of concurrent requests apart
+            date_str = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S-%f")
+            self._write_log(date_str, "1_system-input.txt", system_command)
+            self._write_log(date_str, "2_user-input.txt", user_input)
 
             # https://platform.openai.com/docs/guides/gpt/chat-completions-response-format
 
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=messages
-            )
+            if replayed_response is not None:
+                response = replayed_response
+                with self._stats_lock:
+                    self.usage.replayed += 1
+            else:
+                with span("api_request", model=self.model, request=date_str, attempt=attempt) as request_span:
+                    response = self._create_completion_with_retries(messages, is_valid_callback, deadline)
+                    prompt_tokens, completion_tokens, cached_tokens = self._usage_numbers(response.usage)
+                    request_span.annotate(prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, cached_tokens=cached_tokens)
+
+                if self._transport is not None:
+                    self._transport.record(self.model, messages, response)
             
             finish_reason = response.choices[0].finish_reason
             if finish_reason == "length":
@@ -87,28 +514,32 @@ class ChatGPT:
 
             if finish_reason != "stop":
                 # model didn't finish for whatever reason. Trying again
-                print("model terminated with finish_reason", finish_reason)
+                logger.warning(f"model terminated with finish_reason {finish_reason}")
                 continue
                 
             message = response.choices[0].message.content
             # print("response" + message)
-            with open(os.path.join(self._queries_folder_path, f"{date_str}_3_api-response.txt"), "w") as f:
-                f.write(json.dumps(message, indent=4))
+            self._write_log(date_str, "3_api-response.txt", json.dumps(message, indent=4))
 
             try:
                 response_text = response.choices[0].message.content.strip()
             except:
-                print("Error, got unexpected response format:", response)
+                logger.warning(f"Error, got unexpected response format: {response}")
                 continue
 
-            with open(os.path.join(self._queries_folder_path, f"{date_str}_4_gpt-output.txt"), "w") as f:
-                f.write(response_text)
+            self._write_log(date_str, "4_gpt-output.txt", response_text)
 
             if is_valid_callback:
-                if not is_valid_callback(response_text):
-                    print(f"Response was invalid for request {date_str}. Will try again.")
+                with span("validate_response") as validate_span:
+                    is_valid = is_valid_callback(response_text)
+                    validate_span.annotate(valid=is_valid)
+                if not is_valid:
+                    logger.warning(f"Response was invalid for request {date_str}. Will try again.")
                     continue
 
+            if self._response_cache is not None:
+                self._response_cache[cache_key] = response_text
+
             return response_text
         
         raise RuntimeError(f"Error, could not get a valid response after {max_attempts} tries.")
@@ -1,12 +1,33 @@
 
 import os
+import sys
+import logging
 import argparse
 import subprocess
 
 
-def get_openapi_token() -> str:
+class L10nError(Exception):
+    """
+    Raised for errors that abort the processing of a file or catalog. The
+    command line scripts print the message and exit, the in-process API in
+    l10n_api.py reports it to the caller.
+
+    kind: Short category of the error, e.g. "invalid_response" or "api_error".
+    """
+
+    def __init__(self, message: str, kind: str = "error", path: str = None):
+        super().__init__(message)
+        self.message = message
+        self.kind = kind
+        self.path = path
+
+
+def get_openapi_token(required: bool = True) -> str:
     """
     Fetch token from environment if not found in translate_info.py
+
+    required: If False, None is returned instead of aborting, e.g. when all
+        responses are replayed.
     """
 
     try:
@@ -15,7 +36,7 @@ def get_openapi_token() -> str:
         token_from_file = None
 
     token = token_from_file or os.getenv("CHATGPT_TOKEN")
-    if token is None:
+    if token is None and required:
         print("No OpenAI API token found.")
         print("  Token can be passed as environment variable or in translate_info.py")
         print("  See README.md for more info.")
@@ -36,10 +57,27 @@ def get_app_context():
         return None
 
 
+def log_to_stdout():
+    """
+    The modules that are also used by the in-process API (l10n_api.py) report
+    their progress via logging. The command line scripts print it to stdout
+    like the rest of their output.
+    """
+    logging.basicConfig(stream=sys.stdout, level=logging.INFO, format="%(message)s")
+
+
 def add_common_args(parser: argparse.ArgumentParser):
     parser.add_argument("--openai_api_cooldown", type=int, default=60, help="Adjusts the time in seconds between two calls to the OpenAI API.")
     parser.add_argument("--log-path", type=str, default="queries", help="Optional log folder. The ChatGPT queries and responses will be placed here.")
     parser.add_argument("--no-confirmation", action="store_true", help="Overwrite without confirmation. Ignored if --output is specified.")
+    parser.add_argument("--profile", action="store_true", help="Record how long each phase of the run takes and write a Chrome trace (chrome://tracing, ui.perfetto.dev) to the log folder.")
+    parser.add_argument("--profile-cprofile", action="store_true", help="Together with --profile, additionally write cProfile stats to the log folder.")
+    parser.add_argument("--hedge-percentile", type=float, default=None, help="Optional latency percentile between 0 and 1, e.g. 0.95. A request that is slower than this percentile of the recent requests is sent a second time and the first valid response is used.")
+    parser.add_argument("--hedge-max-ratio", type=float, default=0.1, help="Maximum fraction of requests that may be duplicated by --hedge-percentile.")
+    parser.add_argument("--max-retries", type=int, default=6, help="How often a request is retried after transient API failures like rate limits, server errors or timeouts.")
+    parser.add_argument("--record", type=str, default=None, metavar="PATH", help="Store all API responses in this file so that the run can be repeated offline with --replay.")
+    parser.add_argument("--replay", type=str, default=None, metavar="PATH", help="Answer requests with the responses stored by --record instead of contacting the API.")
+    parser.add_argument("--replay-fall-through", action="store_true", help="Together with --replay, send requests that were not recorded to the API and add their responses to the file.")
 
 
 def user_approved_overwrite_warning() -> bool:
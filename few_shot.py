@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+
+#
+# Marius Montebaur
+#
+# October 2023
+#
+# Selects the few-shot examples for add_localization. Instead of sending the
+# whole PinEntryView reference pair with every file, a handful of small
+# before/after snippets from reference/examples are picked by how similar
+# their Swift constructs are to the file that should be localized.
+#
+
+
+import os
+import re
+import math
+import glob
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Dict, List
+
+
+SCRIPT_FOLDER_PATH = os.path.dirname(os.path.realpath(__file__))
+EXAMPLES_FOLDER_PATH = os.path.join(SCRIPT_FOLDER_PATH, "reference/examples")
+
+# Identifiers, modifiers (".navigationTitle") and a few syntax markers that
+# tell apart the kinds of strings in a file.
+_TOKEN_REGEX = re.compile(r'\.?[A-Za-z_][A-Za-z0-9_]*|"""|\\\(|"')
+
+# The examples are stored with every String(localized:comment:) call in one
+# line and with the same number of lines as their non-localized version, as
+# required by --single-line-modifications. Otherwise, calls in lines longer
+# than this are split up like task_desc_multiline asks for, unless the example
+# comes with a <name>_localized-multiline.swift.
+MAX_LINE_LENGTH = 100
+_STRING_LITERAL_PATTERN = r'"(?:[^"\\\n]|\\.)*"'
+_INLINE_STRING_CALL_REGEX = re.compile(
+    f"String\\(localized: ({_STRING_LITERAL_PATTERN}), comment: ({_STRING_LITERAL_PATTERN})\\)")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Rough token count. Good enough to compare prompt sizes.
+    """
+    return len(text) // 4 + 1
+
+
+def wrap_long_string_calls(source: str, max_line_length: int = MAX_LINE_LENGTH) -> str:
+    """
+    Splits the String(localized:comment:) calls of all lines longer than
+    max_line_length over several lines, indented like the line they are in.
+    """
+    lines = []
+    for line in source.split("\n"):
+        if len(line) <= max_line_length:
+            lines.append(line)
+            continue
+
+        indent = line[:len(line) - len(line.lstrip())]
+        lines.append(_INLINE_STRING_CALL_REGEX.sub(
+            lambda m: f"String(\n{indent}    localized: {m.group(1)},\n{indent}    comment: {m.group(2)}\n{indent})",
+            line
+        ))
+    return "\n".join(lines)
+
+
+def swift_features(source: str) -> Counter:
+    """
+    Unigrams and bigrams of the Swift tokens in source. String contents are
+    dropped so that only the surrounding constructs count.
+    """
+    source = re.sub(r'"(?:[^"\\\n]|\\.)*"', '"', source)
+    tokens = _TOKEN_REGEX.findall(source)
+    features = Counter(tokens)
+    features.update(f"{a} {b}" for a, b in zip(tokens, tokens[1:]))
+    return features
+
+
+@dataclass
+class Example:
+    name: str
+    not_localized: str
+    localized: str
+    # Optional hand-written version for the multi-line mode
+    localized_multiline: str = None
+
+    def localized_for(self, force_single_line: bool) -> str:
+        """
+        The localized version in the line style the model is asked to use.
+        """
+        if force_single_line:
+            return self.localized
+        return self.localized_multiline or wrap_long_string_calls(self.localized)
+
+    @property
+    def tokens(self) -> int:
+        return estimate_tokens(self.not_localized) + estimate_tokens(self.localized)
+
+
+def load_examples(folder_path: str = EXAMPLES_FOLDER_PATH) -> List[Example]:
+    """
+    Loads all <name>_not-localized.swift / <name>_localized.swift pairs and
+    the optional <name>_localized-multiline.swift.
+    """
+    examples = []
+    for not_localized_path in sorted(glob.glob(os.path.join(folder_path, "*_not-localized.swift"))):
+        name = os.path.basename(not_localized_path)[:-len("_not-localized.swift")]
+        localized_path = os.path.join(folder_path, f"{name}_localized.swift")
+        if not os.path.exists(localized_path):
+            continue
+
+        with open(not_localized_path, "r") as f:
+            not_localized = f.read()
+        with open(localized_path, "r") as f:
+            localized = f.read()
+
+        localized_multiline = None
+        localized_multiline_path = os.path.join(folder_path, f"{name}_localized-multiline.swift")
+        if os.path.exists(localized_multiline_path):
+            with open(localized_multiline_path, "r") as f:
+                localized_multiline = f.read()
+
+        examples.append(Example(name, not_localized, localized, localized_multiline))
+
+    return examples
+
+
+@dataclass
+class ExampleSavings:
+    """
+    Compares the size of the selected examples with the size of the reference
+    pair that would have been sent otherwise.
+    """
+    files: int = 0
+    example_tokens: int = 0
+    reference_tokens: int = 0
+
+    @property
+    def saved_tokens(self) -> int:
+        return self.reference_tokens - self.example_tokens
+
+    def summary(self) -> str:
+        saved_percent = 100 * self.saved_tokens / self.reference_tokens if self.reference_tokens else 0
+        return f"Few-shot examples for {self.files} files used ~{self.example_tokens} tokens " \
+            f"instead of ~{self.reference_tokens} for the full reference pair (~{saved_percent:.0f}% saved)."
+
+
+class ExampleIndex:
+    """
+    TF-IDF index over the Swift constructs of the examples' non-localized
+    versions. Built once per run.
+    """
+
+    def __init__(self, examples: List[Example], token_budget: int = 1500, max_examples: int = 4, reference_tokens: int = 0):
+        """
+        token_budget: Maximum estimated tokens of all selected examples.
+        max_examples: Maximum number of selected examples.
+        reference_tokens: Estimated tokens of the full reference pair, only used
+            to report the savings.
+        """
+        self.examples = examples
+        self.token_budget = token_budget
+        self.max_examples = max_examples
+        self.savings = ExampleSavings()
+        self._reference_tokens = reference_tokens
+        self._savings_lock = threading.Lock()
+
+        features = [swift_features(e.not_localized) for e in examples]
+        document_frequency = Counter(f for example_features in features for f in example_features)
+        self._idf = {f: math.log((1 + len(examples)) / (1 + df)) + 1 for f, df in document_frequency.items()}
+        self._vectors = [self._vectorize(example_features) for example_features in features]
+
+    def _vectorize(self, features: Counter) -> Dict[str, float]:
+        vector = {f: (1 + math.log(count)) * self._idf[f] for f, count in features.items() if f in self._idf}
+        norm = math.sqrt(sum(v * v for v in vector.values())) or 1.0
+        return {f: v / norm for f, v in vector.items()}
+
+    def select(self, swift_source: str) -> List[Example]:
+        """
+        Returns the most similar examples that fit into the token budget, most
+        similar first.
+        """
+        query = self._vectorize(swift_features(swift_source))
+        scores = [
+            (sum(weight * vector.get(f, 0.0) for f, weight in query.items()), i)
+            for i, vector in enumerate(self._vectors)
+        ]
+
+        selected = []
+        used_tokens = 0
+        for score, i in sorted(scores, key=lambda s: (-s[0], s[1])):
+            if len(selected) >= self.max_examples:
+                break
+            example = self.examples[i]
+            if score <= 0 or used_tokens + example.tokens > self.token_budget:
+                continue
+            selected.append(example)
+            used_tokens += example.tokens
+
+        with self._savings_lock:
+            self.savings.files += 1
+            self.savings.example_tokens += used_tokens
+            self.savings.reference_tokens += self._reference_tokens
+
+        return selected
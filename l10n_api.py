@@ -0,0 +1,227 @@
+#!/usr/bin/env python3
+
+#
+# Marius Montebaur
+#
+# October 2023
+#
+# In-process API for embedding the localization and translation steps in a
+# long-running service. Unlike the command line scripts, nothing is read from
+# sys.argv, nobody is asked for confirmation and errors are returned instead
+# of exiting the process. Progress is reported via logging, not printed.
+#
+# Example:
+#   session = L10nSession(L10nApiConfig(openai_token="...", app_context="A todo app"))
+#   result = session.translate_catalog(catalog_dict, "de")
+#   if result.ok:
+#       catalog_dict = result.catalog
+#
+
+
+import copy
+import traceback
+from dataclasses import dataclass, field
+from typing import Any, Dict, List
+
+import openai
+
+from chat_gpt_interface import ChatGPT, HedgingPolicy, RateLimiter, ResponseCache, UsageBudget, UsageStats, BudgetExhaustedError
+from retry_policy import RetryPolicy, CircuitBreaker
+from transport import RecordReplayTransport
+from common import L10nError
+from add_localization import localize_swift_source, build_example_index
+from translate_localization import TranslateL10nConfig, TranslationStopped, translate_strings
+
+
+@dataclass
+class L10nApiConfig:
+    # Falls back to the OPENAI_API_KEY environment variable
+    openai_token: str = None
+    model: str = "gpt-4o"
+    cooldown_duration_sec: int = 2
+    # Folder for the query logs, no logs are written if None
+    log_path: str = None
+    # Description of the app which is added to the translation prompts
+    app_context: str = None
+    hedging: HedgingPolicy = None
+    retry_policy: RetryPolicy = None
+    # Send the full reference pair instead of matching few-shot examples
+    full_reference: bool = False
+    example_token_budget: int = 1500
+    # Records or replays the responses, see transport.py. Can be shared
+    # between sessions.
+    transport: RecordReplayTransport = None
+    # Number of responses kept to answer identical queries, 0 disables the
+    # cache. Least recently used responses are dropped first.
+    response_cache_size: int = 1000
+
+
+@dataclass
+class TranslationResult:
+    # Copy of the given catalog with the added translations, None if the given
+    # catalog was invalid
+    catalog: Dict[str, Any]
+    # {language: {key: fingerprint}}, see translate_localization.compute_fingerprint
+    fingerprints: Dict[str, Dict[str, str]]
+    translated_keys: List[str] = field(default_factory=list)
+    errors: List[L10nError] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+
+@dataclass
+class LocalizationResult:
+    # Localized Swift source or None if localizing failed
+    swift_source: str
+    errors: List[L10nError] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.errors
+
+
+def _to_l10n_error(error: Exception, path: str = None) -> L10nError:
+    if isinstance(error, L10nError):
+        if path and not error.path:
+            error.path = path
+        return error
+    if isinstance(error, BudgetExhaustedError):
+        return L10nError(str(error), kind="budget_exhausted", path=path)
+    if isinstance(error, openai.APIError):
+        return L10nError(str(error), kind="api_error", path=path)
+    if isinstance(error, RuntimeError):
+        # ChatGPT.complete_query raises RuntimeError if no valid response was returned
+        return L10nError(str(error), kind="invalid_response", path=path)
+    # Invalid input is rejected before, so anything else is a bug. The
+    # original exception and its traceback are kept as the cause.
+    l10n_error = L10nError(f"{type(error).__name__}: {error}\n{''.join(traceback.format_tb(error.__traceback__))}",
+                           kind="internal_error", path=path)
+    l10n_error.__cause__ = error
+    return l10n_error
+
+
+def _check_catalog(catalog: Dict[str, Any], path: str = None):
+    """
+    Raises L10nError(kind="invalid_input") if catalog does not look like a
+    parsed Localizable.xcstrings.
+    """
+    if not isinstance(catalog, dict):
+        raise L10nError(f"Expected the parsed catalog as dict, got {type(catalog).__name__}.", kind="invalid_input", path=path)
+    for field_name, field_type in (("sourceLanguage", str), ("strings", dict)):
+        if not isinstance(catalog.get(field_name), field_type):
+            raise L10nError(f"The catalog has no valid '{field_name}' entry.", kind="invalid_input", path=path)
+
+    for key, info_dict in catalog["strings"].items():
+        if not isinstance(info_dict, dict):
+            raise L10nError(f"The entry of '{key}' is not a dict.", kind="invalid_input", path=path)
+        if not isinstance(info_dict.get("comment", ""), str):
+            raise L10nError(f"The comment of '{key}' is not a string.", kind="invalid_input", path=path)
+        localizations = info_dict.get("localizations", {})
+        if not isinstance(localizations, dict) or not all(isinstance(l10n, dict) for l10n in localizations.values()):
+            raise L10nError(f"The localizations of '{key}' are not a dict of dicts.", kind="invalid_input", path=path)
+
+
+class L10nSession:
+    """
+    Keeps one ChatGPT client, its rate limiting, retry state and a response
+    cache alive across calls, so that many catalogs and files can be processed
+    in one process.
+    """
+
+    def __init__(self, config: L10nApiConfig = None, circuit_breaker: CircuitBreaker = None,
+                 rate_limiter: RateLimiter = None, budget: UsageBudget = None):
+        """
+        The following can be shared between sessions, e.g. to process several
+        projects under one OpenAI quota:
+
+        circuit_breaker: Pauses all sessions together if the API is unavailable.
+        rate_limiter: Spaces the requests of all sessions.
+        budget: Limits the requests and tokens of all sessions.
+        """
+        self.config = config or L10nApiConfig()
+        self.response_cache = ResponseCache(self.config.response_cache_size) if self.config.response_cache_size else None
+        self.chat_gpt = ChatGPT(
+            self.config.openai_token,
+            model=self.config.model,
+            log_path=self.config.log_path,
+            cooldown_duration_sec=self.config.cooldown_duration_sec,
+            hedging=self.config.hedging,
+            retry_policy=self.config.retry_policy,
+            circuit_breaker=circuit_breaker,
+            response_cache=self.response_cache,
+            rate_limiter=rate_limiter,
+            budget=budget,
+            transport=self.config.transport
+        )
+        self.example_index = None if self.config.full_reference else build_example_index(self.config.example_token_budget)
+
+    @property
+    def usage(self) -> UsageStats:
+        """
+        Requests and tokens used by this session so far.
+        """
+        return self.chat_gpt.usage
+
+    def translate_catalog(self, catalog: Dict[str, Any], target_language: str, update_existing: bool = False,
+                          fingerprints: Dict[str, Dict[str, str]] = None, name: str = None, app_context: str = None) -> TranslationResult:
+        """
+        Translates a parsed Localizable.xcstrings to target_language. The given
+        catalog and fingerprints are not modified. If the budget runs out, the
+        result contains an error together with the strings translated so far.
+
+        fingerprints: Fingerprints returned by a previous call for this catalog.
+            Used to only translate strings that changed since.
+        name: Optional name of the catalog which is attached to errors.
+        app_context: Overrides the app context of the session's config.
+        """
+        try:
+            _check_catalog(catalog, name)
+        except L10nError as e:
+            return TranslationResult(catalog=None, fingerprints=fingerprints or {}, errors=[e])
+
+        catalog = copy.deepcopy(catalog)
+        fingerprints = copy.deepcopy(fingerprints) if fingerprints else {}
+        result = TranslationResult(catalog=catalog, fingerprints=fingerprints)
+
+        conf = TranslateL10nConfig(
+            target_language = target_language,
+            localizable_path = name,
+            openai_api_cooldown = self.config.cooldown_duration_sec,
+            output_path = None,
+            log_path = self.config.log_path,
+            update_existing = update_existing
+        )
+
+        try:
+            translatables = translate_strings(self.chat_gpt, catalog, conf, fingerprints, app_context or self.config.app_context)
+        except TranslationStopped as e:
+            # The catalog and fingerprints contain the batches done until then
+            result.translated_keys = [key for t in e.translated for key, _, _, _ in t.variants]
+            result.errors.append(_to_l10n_error(e, name))
+            return result
+        except Exception as e:
+            result.errors.append(_to_l10n_error(e, name))
+            return result
+
+        result.translated_keys = [key for t in translatables for key, _, _, _ in t.variants]
+        return result
+
+    def localize_swift_source(self, swift_source: str, single_line_modifications: bool = False, name: str = None) -> LocalizationResult:
+        """
+        Replaces the UI strings in swift_source by String(localized:comment:)
+        constructors.
+
+        name: Optional name of the file which is attached to errors.
+        """
+        if not isinstance(swift_source, str):
+            error = L10nError(f"Expected the Swift source as str, got {type(swift_source).__name__}.", kind="invalid_input", path=name)
+            return LocalizationResult(swift_source=None, errors=[error])
+
+        try:
+            localized = localize_swift_source(self.chat_gpt, swift_source, single_line_modifications, self.example_index)
+        except Exception as e:
+            return LocalizationResult(swift_source=None, errors=[_to_l10n_error(e, name)])
+
+        return LocalizationResult(swift_source=localized)
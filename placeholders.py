@@ -0,0 +1,128 @@
+#!/usr/bin/env python3
+
+#
+# Marius Montebaur
+#
+# October 2023
+#
+# Turns numbers and printf/Swift format specifiers in catalog keys into typed
+# placeholders so that keys which only differ in those values share a single
+# translation template.
+#
+
+
+import re
+from typing import List, Tuple
+
+
+# Format specifiers as they appear in String Catalog keys, e.g. %@, %lld, %1$@,
+# %.2f. Must be tried before plain numbers so that "%1$@" is not split up.
+# The space flag is left out, otherwise "20% off" would contain "% o".
+_FORMAT_SPECIFIER_PATTERN = r"%(?:\d+\$)?[-+#0]*\d*(?:\.\d+)?(?:hh|h|ll|l|q|z|t|j|L)?[@dDiuUxXoOfFeEgGcCsSpaA]"
+
+# Stand-alone numbers like 3, 1.0.3 or 1,000. Digits that are part of a word
+# (e.g. "2FA" or "iOS17") are left untouched.
+_NUMBER_PATTERN = r"(?<![\w.%$])\d+(?:[.,]\d+)*(?![\w$])"
+
+FORMAT_SPECIFIER_REGEX = re.compile(_FORMAT_SPECIFIER_PATTERN)
+
+_TEMPLATABLE_REGEX = re.compile(f"(?P<spec>{_FORMAT_SPECIFIER_PATTERN})|(?P<num>{_NUMBER_PATTERN})")
+
+# Matches placeholders created by this module, e.g. {num1}, {str2}, {int3}
+PLACEHOLDER_REGEX = re.compile(r"\{(?:num|int|float|str|char|arg)\d+\}")
+
+
+def _placeholder_type(specifier: str) -> str:
+    """
+    Maps a format specifier to the type used in its placeholder name.
+    """
+    conversion = specifier[-1]
+    if conversion in "@sS":
+        return "str"
+    if conversion in "dDiuUxXoO":
+        return "int"
+    if conversion in "fFeEgGaA":
+        return "float"
+    if conversion in "cC":
+        return "char"
+    return "arg"
+
+
+def templatize(text: str) -> Tuple[str, List[str]]:
+    """
+    Replaces numbers and format specifiers in text with typed placeholders.
+    Returns the template and the original values in placeholder order, e.g.
+    "Version 1.0.3" -> ("Version {num1}", ["1.0.3"]).
+
+    Strings that already contain something looking like a placeholder are
+    returned unchanged to avoid ambiguous substitutions.
+    """
+    if PLACEHOLDER_REGEX.search(text):
+        return text, []
+
+    values: List[str] = []
+
+    def replace(match: re.Match) -> str:
+        values.append(match.group(0))
+        kind = _placeholder_type(match.group("spec")) if match.group("spec") else "num"
+        return f"{{{kind}{len(values)}}}"
+
+    # "%%" is a literal percent sign and must not be read as a specifier.
+    parts = text.split("%%")
+    template = "%%".join(_TEMPLATABLE_REGEX.sub(replace, part) for part in parts)
+    return template, values
+
+
+def placeholders_in(template: str) -> List[str]:
+    """
+    Returns the placeholders of a template in order of appearance.
+    """
+    return PLACEHOLDER_REGEX.findall(template)
+
+
+def has_each_placeholder_once(template: str, translation: str) -> bool:
+    """
+    Checks that every placeholder of the template appears exactly once in the
+    translation and that no other placeholders were made up.
+    """
+    expected = sorted(placeholders_in(template))
+    return sorted(placeholders_in(translation)) == expected and len(set(expected)) == len(expected)
+
+
+def _placeholder_index(placeholder: str) -> int:
+    return int(re.search(r"\d+", placeholder).group(0)) - 1
+
+
+def _make_positional(specifier: str, position: int) -> str:
+    """
+    "%@" -> "%2$@" for position 2. Positional specifiers are kept.
+    """
+    if re.match(r"%\d+\$", specifier):
+        return specifier
+    return f"%{position}${specifier[1:]}"
+
+
+def substitute(template: str, values: List[str]) -> str:
+    """
+    Inverse of templatize: puts the original values back into a (translated)
+    template.
+
+    If the translation reorders format specifiers, the non-positional ones are
+    made positional, e.g. "{str2} hat {str1} eingeladen" for "%@ invited %@"
+    becomes "%2$@ hat %1$@ eingeladen". Otherwise the arguments would be
+    filled into the wrong slots at runtime.
+    """
+    # Argument position of every format specifier in the original string
+    spec_indices = [i for i, value in enumerate(values) if value.startswith("%")]
+    positions = {index: position + 1 for position, index in enumerate(spec_indices)}
+
+    translated_order = [_placeholder_index(p) for p in placeholders_in(template) if _placeholder_index(p) in positions]
+    reordered = translated_order != sorted(translated_order)
+
+    def replace(match: re.Match) -> str:
+        index = _placeholder_index(match.group(0))
+        if reordered and index in positions:
+            return _make_positional(values[index], positions[index])
+        return values[index]
+
+    return PLACEHOLDER_REGEX.sub(replace, template)
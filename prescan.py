@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+#
+# Marius Montebaur
+#
+# October 2023
+#
+# Fast local pre-scan for add_localization. Many .swift files of a project
+# (models, networking, extensions) contain no user-facing strings at all.
+# Files without any candidate string are found locally and never sent to
+# ChatGPT.
+#
+
+
+import os
+import re
+import mmap
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterable, List, Union
+
+
+# Files larger than this are memory-mapped instead of read into memory
+MMAP_THRESHOLD_BYTES = 256 * 1024
+
+# Calls whose string arguments only end up in the console or in logs
+LOGGING_FUNCTIONS = {
+    b"print", b"debugPrint", b"dump", b"NSLog", b"os_log",
+    b"fatalError", b"assert", b"assertionFailure", b"precondition", b"preconditionFailure",
+}
+# Logging methods only count on receivers with one of these names, e.g.
+# logger.debug(...) but not dialog.error(...)
+LOGGER_RECEIVERS = {b"logger", b"log", b"Logger", b"os_log"}
+LOGGER_METHODS = {b"trace", b"debug", b"info", b"notice", b"log", b"warning", b"error", b"critical", b"fault"}
+
+# Calls whose string arguments are already localized. String(localized:) and
+# Text(verbatim:) are recognized by their first argument label.
+LOCALIZATION_FUNCTIONS = {b"NSLocalizedString", b"LocalizedStringResource", b"LocalizedStringKey"}
+
+# Arguments that name an asset, a symbol or a key instead of containing text
+IDENTIFIER_LABELS = [
+    "systemName", "systemImage", "named", "forKey", "forResource", "withIdentifier",
+    "forCellReuseIdentifier", "forCellWithReuseIdentifier", "forHeaderFooterViewReuseIdentifier",
+]
+
+# Comments are matched so that quotes inside of them are ignored. Strings
+# after one of the IDENTIFIER_LABELS are matched as a whole. Calls are
+# matched together with the receiver of a method call ("logger.debug(") and a
+# "localized:" or "verbatim:" label directly after the opening parenthesis.
+_TOKEN_REGEX = re.compile(
+    rb'(?P<comment>//[^\n]*|/\*.*?\*/)'
+    rb'|(?P<identifier>\b(?:' + "|".join(IDENTIFIER_LABELS).encode() + rb')\s*:\s*"(?:[^"\\\n]|\\.)*")'
+    rb'|(?P<string>"""(?:[^\\]|\\.)*?"""|"(?:[^"\\\n]|\\.)*")'
+    rb'|(?:(?P<receiver>[A-Za-z_]\w*)\s*\.\s*)?(?P<call>[A-Za-z_]\w*)\s*\((?P<label>\s*(?:localized|verbatim)\s*:)?'
+    rb'|(?P<open>\()'
+    rb'|(?P<close>\))',
+    re.DOTALL
+)
+
+# Strings without any letter outside of interpolations and format specifiers,
+# like "", "%04d", "\(a) - \(b)" or " - ", are not UI text
+_LETTER_REGEX = re.compile(rb'[A-Za-z\x80-\xff]')
+_NON_TEXT_REGEX = re.compile(rb'\\\([^)]*\)|\\.|%[-+ #0-9.$]*(?:ll|l|hh|h)?[a-zA-Z@]')
+
+
+def _is_text(literal: bytes) -> bool:
+    return _LETTER_REGEX.search(_NON_TEXT_REGEX.sub(b"", literal)) is not None
+
+
+_OTHER, _LOGGING, _LOCALIZED = 0, 1, 2
+
+
+def _call_kind(match: re.Match) -> int:
+    call = match.group("call")
+    if match.group("label") or call in LOCALIZATION_FUNCTIONS:
+        return _LOCALIZED
+    if call in LOGGING_FUNCTIONS:
+        return _LOGGING
+
+    receiver = match.group("receiver")
+    if receiver in LOGGER_RECEIVERS and call in LOGGER_METHODS:
+        return _LOGGING
+    return _OTHER
+
+
+def has_localizable_candidates(source: Union[bytes, mmap.mmap]) -> bool:
+    """
+    Returns whether source contains at least one string literal that might be
+    shown in the UI. Literals that are already localized (String(localized:),
+    NSLocalizedString, ...), marked as verbatim or only passed to print or
+    logging calls are ignored. Errs on the side of returning True.
+    """
+    if source.find(b'"') == -1:
+        return False
+
+    # Kind of each open parenthesis and the number of them that are
+    # logging or localization calls
+    call_stack = []
+    excluding_calls = 0
+
+    for match in _TOKEN_REGEX.finditer(source):
+        group = match.lastgroup
+        if group in ("comment", "identifier"):
+            continue
+
+        if group == "string":
+            if excluding_calls == 0 and _is_text(match.group("string")):
+                return True
+
+        elif group == "open":
+            call_stack.append(_OTHER)
+
+        elif group == "close":
+            if call_stack and call_stack.pop() != _OTHER:
+                excluding_calls -= 1
+
+        else:
+            kind = _call_kind(match)
+            call_stack.append(kind)
+            if kind != _OTHER:
+                excluding_calls += 1
+
+    return False
+
+
+def file_has_localizable_candidates(path: str) -> bool:
+    """
+    Reads the file at path and checks it with has_localizable_candidates.
+    """
+    with open(path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return False
+        if size < MMAP_THRESHOLD_BYTES:
+            return has_localizable_candidates(f.read())
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            return has_localizable_candidates(mapped)
+
+
+def find_files_with_candidates(paths: Iterable[str], max_workers: int = None) -> List[bool]:
+    """
+    Checks all files in parallel. Returns one bool per path in the same order.
+
+    The scan is CPU-bound regex work, so the files are spread over processes
+    instead of threads.
+    """
+    paths = list(paths)
+    if len(paths) <= 1 or max_workers == 1:
+        return [file_has_localizable_candidates(path) for path in paths]
+
+    max_workers = min(max_workers or os.cpu_count() or 1, len(paths))
+    chunksize = max(1, len(paths) // (4 * max_workers))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(file_has_localizable_candidates, paths, chunksize=chunksize))
@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+
+#
+# Marius Montebaur
+#
+# October 2023
+#
+# Orders the strings of a catalog by how much their translation matters, so
+# that a run which is cut short by --deadline or --budget has translated the
+# most important strings:
+#   1. strings without a translation in any language
+#   2. strings used in recently changed Swift files (--swift-root)
+#   3. translations that Xcode marked as needs_review
+#   4. everything else, e.g. translations whose comment changed
+#
+
+
+import os
+import re
+import time
+import logging
+import subprocess
+from pathlib import Path
+from typing import Dict, List, Set
+
+from placeholders import FORMAT_SPECIFIER_REGEX
+
+
+logger = logging.getLogger(__name__)
+
+
+PRIORITY_UNTRANSLATED = 0
+PRIORITY_RECENTLY_CHANGED = 1
+PRIORITY_NEEDS_REVIEW = 2
+PRIORITY_OTHER = 3
+
+PRIORITY_NAMES = {
+    PRIORITY_UNTRANSLATED: "untranslated",
+    PRIORITY_RECENTLY_CHANGED: "recently changed",
+    PRIORITY_NEEDS_REVIEW: "needs review",
+    PRIORITY_OTHER: "other",
+}
+
+_STRING_LITERAL_REGEX = re.compile(r'"""(.*?)"""|"((?:[^"\\\n]|\\.)*)"', re.DOTALL)
+# Interpolations may contain one level of parentheses, e.g. \(items.count(where: ...))
+_INTERPOLATION_REGEX = re.compile(r'\\\((?:[^()]|\([^()]*\))*\)')
+_ESCAPES = {'\\"': '"', "\\n": "\n", "\\t": "\t", "\\\\": "\\"}
+_ESCAPE_REGEX = re.compile(r'\\["nt\\]')
+
+# Format specifiers in keys and interpolations in Swift literals are both
+# replaced by this marker, "Hello %@" and "Hello \(name)" are the same string.
+_ARGUMENT_MARKER = "\0"
+
+
+def _git_changed_swift_files(swift_root: str, max_age_days: float) -> List[str]:
+    """
+    Returns the .swift files below swift_root with uncommitted changes or
+    commits within the last max_age_days, most recently changed first. Raises
+    CalledProcessError or OSError if swift_root is not in a Git repository.
+    """
+    swift_root = os.path.abspath(swift_root)
+    repo_root = subprocess.run(
+        ['git', '-C', swift_root, 'rev-parse', '--show-toplevel'],
+        capture_output=True, text=True, check=True
+    ).stdout.strip()
+
+    uncommitted = subprocess.run(
+        ['git', '-C', repo_root, 'status', '--porcelain', '--untracked-files=all', '--', swift_root],
+        capture_output=True, text=True, check=True
+    ).stdout.splitlines()
+    # Porcelain lines are "XY path" or "XY old -> new"
+    paths = [line[3:].split(" -> ")[-1].strip('"') for line in uncommitted]
+
+    committed = subprocess.run(
+        ['git', '-C', repo_root, 'log', f'--since={int(max_age_days * 24 * 60 * 60)} seconds ago',
+         '--name-only', '--pretty=format:', '--', swift_root],
+        capture_output=True, text=True, check=True
+    ).stdout.splitlines()
+    paths += [line for line in committed if line]
+
+    files = []
+    for path in dict.fromkeys(paths):
+        path = os.path.join(repo_root, path)
+        if path.endswith(".swift") and os.path.isfile(path):
+            files.append(path)
+    return files
+
+
+def find_recently_changed_swift_files(swift_root: str, max_age_days: float = 14) -> List[str]:
+    """
+    Returns the .swift files below swift_root that changed within the last
+    max_age_days, most recently changed first.
+
+    The Git history is used if swift_root is part of a repository. Otherwise,
+    the modification times of the files are used, which only makes sense if
+    the files were not freshly copied or checked out.
+    """
+    try:
+        return _git_changed_swift_files(swift_root, max_age_days)
+    except (subprocess.CalledProcessError, OSError):
+        logger.info(f"{swift_root} is not in a Git repository, using file modification times to find recently changed files.")
+
+    oldest = time.time() - max_age_days * 24 * 60 * 60
+    files = []
+    for path in Path(swift_root).rglob("*.swift"):
+        mtime = os.path.getmtime(path)
+        if mtime >= oldest:
+            files.append((mtime, str(path)))
+    return [path for _, path in sorted(files, reverse=True)]
+
+
+def normalize_key(key: str) -> str:
+    """
+    Catalog key as it is compared with the strings in Swift files.
+    """
+    return FORMAT_SPECIFIER_REGEX.sub(_ARGUMENT_MARKER, key)
+
+
+def _normalize_literal(literal: str) -> str:
+    literal = _INTERPOLATION_REGEX.sub(_ARGUMENT_MARKER, literal)
+    return _ESCAPE_REGEX.sub(lambda m: _ESCAPES[m.group(0)], literal)
+
+
+def collect_referenced_keys(swift_paths: List[str]) -> Set[str]:
+    """
+    Returns the normalized contents of all string literals in the given files,
+    see normalize_key.
+    """
+    keys = set()
+    for path in swift_paths:
+        with open(path, "r", errors="replace") as f:
+            source = f.read()
+        for match in _STRING_LITERAL_REGEX.finditer(source):
+            if match.group(1) is not None:
+                # Multi-line literals start and end with a line break
+                literal = match.group(1).strip("\n")
+            else:
+                literal = match.group(2)
+            keys.add(_normalize_literal(literal))
+    return keys
+
+
+def translation_priority(key: str, info_dict: Dict[str, any], target_language: str, source_language: str = None,
+                         recent_keys: Set[str] = None) -> int:
+    """
+    Returns one of the PRIORITY_* constants for a string of the catalog that
+    needs to be translated to target_language. Lower is more important.
+    """
+    localizations = info_dict.get("localizations", {})
+    if not any(language != source_language for language in localizations):
+        return PRIORITY_UNTRANSLATED
+
+    if recent_keys and normalize_key(key) in recent_keys:
+        return PRIORITY_RECENTLY_CHANGED
+
+    state = localizations.get(target_language, {}).get("stringUnit", {}).get("state")
+    if state == "needs_review":
+        return PRIORITY_NEEDS_REVIEW
+
+    return PRIORITY_OTHER
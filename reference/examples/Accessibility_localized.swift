@@ -0,0 +1,6 @@
+Image(systemName: "heart.fill")
+    .accessibilityLabel(String(localized: "Favorite", comment: "VoiceOver label of the heart icon that marks a photo as favorite."))
+Button(action: share) {
+    Image(systemName: "square.and.arrow.up")
+}
+.help(String(localized: "Share this photo", comment: "Tooltip of the share button in the photo detail view."))
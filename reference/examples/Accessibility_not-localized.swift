@@ -0,0 +1,6 @@
+Image(systemName: "heart.fill")
+    .accessibilityLabel("Favorite")
+Button(action: share) {
+    Image(systemName: "square.and.arrow.up")
+}
+.help("Share this photo")
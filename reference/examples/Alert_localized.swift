@@ -0,0 +1,6 @@
+.alert(String(localized: "Delete Item?", comment: "Title of the alert that asks the user to confirm deleting an item."), isPresented: $showingDeleteAlert) {
+    Button(String(localized: "Delete", comment: "Destructive button in the delete confirmation alert."), role: .destructive) { deleteItem() }
+    Button(String(localized: "Cancel", comment: "Button that dismisses the delete confirmation alert."), role: .cancel) { }
+} message: {
+    Text(String(localized: "This action cannot be undone.", comment: "Message of the alert that asks the user to confirm deleting an item."))
+}
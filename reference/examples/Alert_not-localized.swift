@@ -0,0 +1,6 @@
+.alert("Delete Item?", isPresented: $showingDeleteAlert) {
+    Button("Delete", role: .destructive) { deleteItem() }
+    Button("Cancel", role: .cancel) { }
+} message: {
+    Text("This action cannot be undone.")
+}
@@ -0,0 +1,3 @@
+Text(String(localized: "Settings", comment: "Title of the settings view."))
+Text(String(localized: "Version", comment: "Label in front of the app version number in the settings view."))
+UserDefaults.standard.set(true, forKey: "didShowOnboarding")
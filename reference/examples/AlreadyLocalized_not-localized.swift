@@ -0,0 +1,3 @@
+Text(String(localized: "Settings", comment: "Title of the settings view."))
+Text("Version")
+UserDefaults.standard.set(true, forKey: "didShowOnboarding")
@@ -0,0 +1,10 @@
+enum Priority {
+    case low, high
+
+    var title: String {
+        switch self {
+        case .low: return String(localized: "Low", comment: "Name of the low task priority shown in the priority picker.")
+        case .high: return String(localized: "High", comment: "Name of the high task priority shown in the priority picker.")
+        }
+    }
+}
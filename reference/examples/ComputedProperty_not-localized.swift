@@ -0,0 +1,10 @@
+enum Priority {
+    case low, high
+
+    var title: String {
+        switch self {
+        case .low: return "Low"
+        case .high: return "High"
+        }
+    }
+}
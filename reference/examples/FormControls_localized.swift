@@ -0,0 +1,9 @@
+Form {
+    Section(header: Text(String(localized: "Notifications", comment: "Header of the notification section in the settings form.")), footer: Text(String(localized: "You can change this later in Settings.", comment: "Footer below the notification section in the settings form."))) {
+        Toggle(String(localized: "Daily Reminder", comment: "Toggle label that enables a daily reminder notification."), isOn: $dailyReminder)
+        Picker(String(localized: "Sound", comment: "Title of the picker that selects the notification sound."), selection: $sound) {
+            Text(String(localized: "None", comment: "Picker option for no notification sound.")).tag(Sound.none)
+            Text(String(localized: "Chime", comment: "Picker option for a chime as notification sound.")).tag(Sound.chime)
+        }
+    }
+}
@@ -0,0 +1,9 @@
+Form {
+    Section(header: Text("Notifications"), footer: Text("You can change this later in Settings.")) {
+        Toggle("Daily Reminder", isOn: $dailyReminder)
+        Picker("Sound", selection: $sound) {
+            Text("None").tag(Sound.none)
+            Text("Chime").tag(Sound.chime)
+        }
+    }
+}
@@ -0,0 +1,3 @@
+Text(String(localized: "\(count) items selected", comment: "Label showing how many items the user selected in the list."))
+Text(String(localized: "Welcome back, \(user.firstName)!", comment: "Greeting at the top of the home screen with the user's first name."))
+Label(String(localized: "Last synced \(lastSyncDate.formatted())", comment: "Label in the footer showing when the data was last synchronized."), systemImage: "arrow.clockwise")
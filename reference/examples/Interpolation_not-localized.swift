@@ -0,0 +1,3 @@
+Text("\(count) items selected")
+Text("Welcome back, \(user.firstName)!")
+Label("Last synced \(lastSyncDate.formatted())", systemImage: "arrow.clockwise")
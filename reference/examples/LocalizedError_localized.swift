@@ -0,0 +1,10 @@
+enum UploadError: LocalizedError {
+    case noConnection
+
+    var errorDescription: String? {
+        switch self {
+        case .noConnection:
+            return String(localized: "No internet connection. Please try again later.", comment: "Error message shown when an upload fails because the device is offline.")
+        }
+    }
+}
@@ -0,0 +1,10 @@
+enum UploadError: LocalizedError {
+    case noConnection
+
+    var errorDescription: String? {
+        switch self {
+        case .noConnection:
+            return "No internet connection. Please try again later."
+        }
+    }
+}
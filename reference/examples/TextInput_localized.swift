@@ -0,0 +1,8 @@
+VStack {
+    TextField(String(localized: "Email", comment: "Placeholder of the email text field on the sign in screen."), text: $email)
+        .textContentType(.emailAddress)
+    SecureField(String(localized: "Password", comment: "Placeholder of the password field on the sign in screen."), text: $password)
+    Button(String(localized: "Sign In", comment: "Button on the sign in screen that logs the user in.")) {
+        signIn()
+    }
+}
@@ -0,0 +1,8 @@
+VStack {
+    TextField("Email", text: $email)
+        .textContentType(.emailAddress)
+    SecureField("Password", text: $password)
+    Button("Sign In") {
+        signIn()
+    }
+}
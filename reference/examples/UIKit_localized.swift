@@ -0,0 +1,7 @@
+override func viewDidLoad() {
+    super.viewDidLoad()
+    titleLabel.text = String(localized: "Your Orders", comment: "Title label at the top of the order list screen.")
+    emptyStateLabel.text = String(localized: "You have not placed any orders yet.", comment: "Text shown in the order list when the user has no orders.")
+    navigationItem.rightBarButtonItem = UIBarButtonItem(title: String(localized: "Filter", comment: "Navigation bar button that opens the order filter."), style: .plain, target: self, action: #selector(showFilter))
+    tableView.register(OrderCell.self, forCellReuseIdentifier: "OrderCell")
+}
@@ -0,0 +1,7 @@
+override func viewDidLoad() {
+    super.viewDidLoad()
+    titleLabel.text = "Your Orders"
+    emptyStateLabel.text = "You have not placed any orders yet."
+    navigationItem.rightBarButtonItem = UIBarButtonItem(title: "Filter", style: .plain, target: self, action: #selector(showFilter))
+    tableView.register(OrderCell.self, forCellReuseIdentifier: "OrderCell")
+}
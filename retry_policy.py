@@ -0,0 +1,165 @@
+#!/usr/bin/env python3
+
+#
+# Marius Montebaur
+#
+# October 2023
+#
+# Retry handling for transient OpenAI API failures: tells retryable errors from
+# fatal ones, computes capped exponential backoff with jitter and provides a
+# circuit breaker that pauses all requests together during an outage.
+#
+
+
+import time
+import random
+import logging
+import threading
+import email.utils
+from dataclasses import dataclass
+
+import openai
+
+
+logger = logging.getLogger(__name__)
+
+
+# Request timeout, conflict, rate limit and server errors
+RETRYABLE_STATUS_CODES = {408, 409, 429}
+
+# Error codes that come with a retryable status code but won't go away by
+# retrying. OpenAI answers with 429 if the account ran out of credits.
+FATAL_ERROR_CODES = {"insufficient_quota"}
+
+
+def is_retryable(error: Exception) -> bool:
+    """
+    Connection problems, timeouts, rate limits and server errors are worth
+    retrying. Everything else (e.g. invalid API key, a bad request or an
+    exhausted quota) is fatal.
+    """
+    if isinstance(error, (openai.APIConnectionError, ConnectionError, TimeoutError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        if getattr(error, "code", None) in FATAL_ERROR_CODES:
+            return False
+        return error.status_code in RETRYABLE_STATUS_CODES or error.status_code >= 500
+    return False
+
+
+def server_retry_hint(error: Exception) -> float:
+    """
+    Returns the number of seconds the server asked us to wait before retrying
+    or None if the response did not contain a hint.
+    """
+    headers = getattr(getattr(error, "response", None), "headers", None)
+    if not headers:
+        return None
+
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        try:
+            return float(retry_after_ms) / 1000
+        except ValueError:
+            pass
+
+    retry_after = headers.get("retry-after")
+    if retry_after:
+        try:
+            return float(retry_after)
+        except ValueError:
+            pass
+
+        # Retry-After may also be an HTTP date
+        try:
+            retry_date = email.utils.parsedate_to_datetime(retry_after)
+        except (TypeError, ValueError):
+            # Not a valid date either, ignore the header
+            return None
+        if retry_date is not None:
+            return max(0.0, retry_date.timestamp() - time.time())
+
+    return None
+
+
+@dataclass
+class RetryPolicy:
+    # Number of retries after the first failed request.
+    max_retries: int = 6
+    base_delay_sec: float = 1.0
+    max_delay_sec: float = 60.0
+
+    def backoff_delay(self, retry_idx: int, retry_hint: float = None) -> float:
+        """
+        Capped exponential backoff with full jitter. A hint from the server
+        takes precedence if it asks for a longer pause.
+        """
+        capped = min(self.max_delay_sec, self.base_delay_sec * 2 ** retry_idx)
+        delay = random.uniform(0, capped)
+        if retry_hint is not None:
+            delay = max(delay, retry_hint)
+        return delay
+
+
+class CircuitBreaker:
+    """
+    Counts consecutive failures of all requests that share this breaker. After
+    failure_threshold failures (or when the server asks for a pause), the
+    breaker opens and every request waits in wait_until_closed until the
+    pause is over. Then a single request is let through as a probe. If it
+    succeeds, all waiting requests continue, otherwise the breaker opens again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout_sec: float = 30):
+        self._failure_threshold = failure_threshold
+        self._reset_timeout_sec = reset_timeout_sec
+        self._condition = threading.Condition()
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._open_until = 0.0
+
+    @property
+    def state(self) -> str:
+        return self._state
+
+    def wait_until_closed(self):
+        with self._condition:
+            while True:
+                if self._state == self.CLOSED:
+                    return
+
+                if self._state == self.OPEN:
+                    remaining = self._open_until - time.time()
+                    if remaining <= 0:
+                        # This caller becomes the probe
+                        self._state = self.HALF_OPEN
+                        return
+                    logger.warning(f"  -- OpenAI API seems to be unavailable, pausing all requests for {remaining:.0f} secs --")
+                    self._condition.wait(remaining)
+                    continue
+
+                # HALF_OPEN: wait for the probe's outcome
+                self._condition.wait()
+
+    def record_success(self):
+        with self._condition:
+            self._consecutive_failures = 0
+            self._state = self.CLOSED
+            self._condition.notify_all()
+
+    def record_failure(self, retry_hint: float = None):
+        with self._condition:
+            self._consecutive_failures += 1
+            should_open = self._state == self.HALF_OPEN \
+                or self._consecutive_failures >= self._failure_threshold \
+                or retry_hint is not None
+
+            if should_open:
+                pause = max(self._reset_timeout_sec if retry_hint is None else 0, retry_hint or 0)
+                self._open_until = max(self._open_until, time.time() + pause)
+                self._state = self.OPEN
+                self._condition.notify_all()
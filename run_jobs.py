@@ -0,0 +1,450 @@
+#!/usr/bin/env python3
+
+#
+# Marius Montebaur
+#
+# October 2023
+#
+# Runs add_localization and translate_localization for many projects from a
+# single process. All projects share one rate limit, one request/token budget
+# and one circuit breaker. Projects take turns according to their priority.
+#
+# Example manifest:
+# {
+#   "budget": {"max_requests": 500, "max_tokens": 2000000},
+#   "projects": [
+#     {
+#       "name": "TodoApp",
+#       "priority": 2,
+#       "app_context": "A todo list app.",
+#       "swift_root": "todo/Sources",
+#       "catalogs": ["todo/Localizable.xcstrings"],
+#       "target_languages": ["de", "fr"]
+#     }
+#   ]
+# }
+#
+# Relative paths are resolved relative to the manifest's folder.
+#
+
+
+import os
+import copy
+import json
+import argparse
+import threading
+from pathlib import Path
+from dataclasses import dataclass, field, fields
+from typing import Dict, List
+
+from chat_gpt_interface import HedgingPolicy, RateLimiter, UsageBudget
+from retry_policy import RetryPolicy, CircuitBreaker
+from l10n_api import L10nSession, L10nApiConfig
+from translate_localization import get_fingerprints_path, load_fingerprints, save_fingerprints
+from tracing import span, profiling
+from prescan import find_files_with_candidates
+from transport import RecordReplayTransport, create_transport
+from common import L10nError, get_app_context, get_openapi_token, add_common_args, user_approved_overwrite_warning, file_has_uncommitted_changes, log_to_stdout
+
+
+@dataclass
+class Project:
+    name: str
+    priority: int = 1
+    app_context: str = None
+    # Folder whose .swift files are localized in place
+    swift_root: str = None
+    catalogs: List[str] = field(default_factory=list)
+    target_languages: List[str] = field(default_factory=list)
+    single_line_modifications: bool = False
+    update_existing: bool = False
+
+
+@dataclass
+class Job:
+    project: Project
+    # "localize" a Swift file or "translate" a catalog
+    kind: str
+    path: str
+    language: str = None
+
+    def describe(self) -> str:
+        if self.kind == "translate":
+            return f"translate {self.path} to {self.language}"
+        return f"localize {self.path}"
+
+
+@dataclass
+class ProjectProgress:
+    total: int = 0
+    done: int = 0
+    failed: int = 0
+    # Jobs that were not started because the budget was used up
+    skipped: int = 0
+    errors: List[L10nError] = field(default_factory=list)
+
+
+@dataclass
+class JobRunnerConfig:
+    manifest_path: str
+    projects: List[Project]
+    workers: int
+    openai_api_cooldown: int
+    log_path: str
+    max_requests: int = None
+    max_tokens: int = None
+    profile: bool = False
+    profile_cprofile: bool = False
+    hedge_percentile: float = None
+    hedge_max_ratio: float = 0.1
+    max_retries: int = 6
+    # Responses are recorded to or replayed from these files, see transport.py
+    record_path: str = None
+    replay_path: str = None
+    replay_fall_through: bool = False
+
+
+def _check_project_dict(project_dict: Dict[str, any], manifest_path: str):
+    """
+    Raises an L10nError if project_dict can't be turned into a Project.
+    """
+    if not isinstance(project_dict, dict):
+        raise L10nError(f"Each project in the manifest must be an object, got: {project_dict!r}", "invalid_input", manifest_path)
+
+    known_keys = {f.name for f in fields(Project)}
+    unknown_keys = sorted(set(project_dict) - known_keys)
+    if unknown_keys:
+        name = project_dict.get("name", "<unnamed>")
+        raise L10nError(f"Unknown key(s) {', '.join(unknown_keys)} for project {name} in manifest. "
+                        f"Known keys: {', '.join(sorted(known_keys))}", "invalid_input", manifest_path)
+
+    if "name" not in project_dict:
+        raise L10nError(f"Project without a name in manifest: {project_dict!r}", "invalid_input", manifest_path)
+
+
+def load_manifest(manifest_path: str) -> Dict[str, any]:
+    """
+    Reads the manifest and turns its projects into Project objects with
+    absolute paths. Raises an L10nError if the manifest is malformed.
+    """
+    with open(manifest_path, "r") as f:
+        try:
+            manifest = json.loads(f.read())
+        except json.JSONDecodeError as e:
+            raise L10nError(f"Manifest is not valid JSON: {e}", "invalid_input", manifest_path)
+
+    manifest_folder = os.path.dirname(os.path.abspath(manifest_path))
+
+    def resolve(path: str) -> str:
+        return os.path.normpath(os.path.join(manifest_folder, path))
+
+    projects = []
+    for project_dict in manifest.get("projects", []):
+        _check_project_dict(project_dict, manifest_path)
+        project = Project(**project_dict)
+        if project.swift_root:
+            project.swift_root = resolve(project.swift_root)
+        project.catalogs = [resolve(c) for c in project.catalogs]
+        projects.append(project)
+
+    manifest["projects"] = projects
+    return manifest
+
+
+def build_jobs(project: Project) -> List[Job]:
+    """
+    Swift files are localized first, then each catalog is translated to each
+    target language.
+    """
+    jobs = []
+
+    if project.swift_root:
+        swift_paths = []
+        for swift_path in sorted(Path(project.swift_root).rglob("*.swift")):
+            swift_path = str(swift_path)
+            if file_has_uncommitted_changes(swift_path):
+                print(f"[{project.name}] File has uncommited changes. Skipping.")
+                print("  ", swift_path)
+                continue
+            swift_paths.append(swift_path)
+
+        has_candidates = find_files_with_candidates(swift_paths)
+        skipped = has_candidates.count(False)
+        if skipped:
+            print(f"[{project.name}] Skipping {skipped} of {len(swift_paths)} files without UI strings.")
+        jobs.extend(Job(project, "localize", path) for path, keep in zip(swift_paths, has_candidates) if keep)
+
+    for catalog_path in project.catalogs:
+        for language in project.target_languages:
+            jobs.append(Job(project, "translate", catalog_path, language))
+
+    return jobs
+
+
+class FairScheduler:
+    """
+    Hands out the jobs of all projects from one queue. Projects take turns in
+    proportion to their priority (stride scheduling), i.e. a project with
+    priority 2 gets twice as many turns as one with priority 1, and no project
+    has to wait for another one to finish.
+    """
+
+    def __init__(self, jobs_by_project: Dict[str, List[Job]], priorities: Dict[str, int]):
+        self._lock = threading.Lock()
+        self._queues = {name: list(jobs) for name, jobs in jobs_by_project.items() if jobs}
+        self._strides = {name: 1.0 / max(1, priorities.get(name, 1)) for name in self._queues}
+        self._passes = {name: 0.0 for name in self._queues}
+        self._stopped = False
+
+    def next_job(self) -> Job:
+        """
+        Returns None once all jobs were handed out or after stop().
+        """
+        with self._lock:
+            if self._stopped or not self._queues:
+                return None
+
+            # Lowest pass goes next, ties are broken by the smaller stride (higher priority)
+            name = min(self._queues, key=lambda n: (self._passes[n], self._strides[n]))
+            self._passes[name] += self._strides[name]
+
+            queue = self._queues[name]
+            job = queue.pop(0)
+            if not queue:
+                del self._queues[name]
+            return job
+
+    def stop(self) -> List[Job]:
+        """
+        Stops handing out jobs and returns those that were not started.
+        """
+        with self._lock:
+            self._stopped = True
+            remaining = [job for queue in self._queues.values() for job in queue]
+            self._queues = {}
+            return remaining
+
+
+class _CatalogState:
+    """
+    A catalog on disk that is translated to several languages in parallel.
+    Translations are merged and written under a lock.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        with open(path, "r") as f:
+            self.catalog = json.loads(f.read())
+        self.fingerprints_path = get_fingerprints_path(path)
+        self.fingerprints = load_fingerprints(self.fingerprints_path)
+
+    def merge_and_save(self, language: str, translated_catalog: Dict[str, any], translated_keys: List[str], fingerprints: Dict[str, str]):
+        with self.lock:
+            strings = self.catalog["strings"]
+            for key in translated_keys:
+                l10n = translated_catalog["strings"][key]["localizations"][language]
+                strings[key].setdefault("localizations", {})[language] = l10n
+            self.fingerprints[language] = fingerprints
+
+            with open(self.path, "w") as f:
+                f.write(json.dumps(self.catalog, indent=2, separators=(', ', ' : '), ensure_ascii=False))
+            save_fingerprints(self.fingerprints_path, self.fingerprints)
+
+
+class JobRunner:
+
+    def __init__(self, conf: JobRunnerConfig, openai_token: str, transport: RecordReplayTransport = None):
+        """
+        transport: Optional, shared by all projects.
+        """
+        self._conf = conf
+        self._projects = {p.name: p for p in conf.projects}
+        self._progress = {p.name: ProjectProgress() for p in conf.projects}
+        self._progress_lock = threading.Lock()
+
+        # Shared between all projects
+        self.budget = UsageBudget(conf.max_requests, conf.max_tokens)
+        rate_limiter = RateLimiter(conf.openai_api_cooldown)
+        circuit_breaker = CircuitBreaker()
+        hedging = HedgingPolicy(conf.hedge_percentile, conf.hedge_max_ratio) if conf.hedge_percentile else None
+
+        self._sessions: Dict[str, L10nSession] = {}
+        for project in conf.projects:
+            api_config = L10nApiConfig(
+                openai_token = openai_token,
+                cooldown_duration_sec = conf.openai_api_cooldown,
+                log_path = os.path.join(conf.log_path, project.name),
+                app_context = project.app_context or get_app_context(),
+                hedging = hedging,
+                retry_policy = RetryPolicy(max_retries=conf.max_retries),
+                transport = transport
+            )
+            self._sessions[project.name] = L10nSession(api_config, circuit_breaker, rate_limiter, self.budget)
+
+        jobs_by_project = {p.name: build_jobs(p) for p in conf.projects}
+        for name, jobs in jobs_by_project.items():
+            self._progress[name].total = len(jobs)
+
+        self._scheduler = FairScheduler(jobs_by_project, {p.name: p.priority for p in conf.projects})
+        self._catalogs: Dict[str, _CatalogState] = {}
+        self._catalogs_lock = threading.Lock()
+
+    def _get_catalog(self, path: str) -> _CatalogState:
+        with self._catalogs_lock:
+            if path not in self._catalogs:
+                self._catalogs[path] = _CatalogState(path)
+            return self._catalogs[path]
+
+    def _run_job(self, job: Job) -> List[L10nError]:
+        session = self._sessions[job.project.name]
+
+        if job.kind == "localize":
+            with open(job.path, "r") as f:
+                swift_source = f.read()
+            result = session.localize_swift_source(swift_source, job.project.single_line_modifications, name=job.path)
+            if result.ok:
+                with open(job.path, "w") as f:
+                    f.write(result.swift_source)
+            return result.errors
+
+        catalog = self._get_catalog(job.path)
+        # Snapshot, so that other languages of this catalog can be merged meanwhile
+        with catalog.lock:
+            snapshot = copy.deepcopy(catalog.catalog)
+            fingerprints = {job.language: dict(catalog.fingerprints.get(job.language, {}))}
+
+        result = session.translate_catalog(snapshot, job.language, job.project.update_existing, fingerprints, name=job.path)
+        # A run that was stopped by the budget still keeps its finished batches
+        if result.translated_keys:
+            catalog.merge_and_save(job.language, result.catalog, result.translated_keys, result.fingerprints.get(job.language, {}))
+        return result.errors
+
+    def _report(self, job: Job, errors: List[L10nError]):
+        with self._progress_lock:
+            progress = self._progress[job.project.name]
+            if errors:
+                progress.failed += 1
+                progress.errors.extend(errors)
+            else:
+                progress.done += 1
+
+            status = "failed" if errors else "done"
+            print(f"[{job.project.name}] {status}: {job.describe()} ({progress.done + progress.failed}/{progress.total})")
+            for error in errors:
+                print(f"  {error.kind}: {error.message}")
+
+    def _worker(self):
+        while True:
+            job = self._scheduler.next_job()
+            if job is None:
+                return
+
+            with span("job", project=job.project.name, kind=job.kind, path=job.path, language=job.language):
+                errors = self._run_job(job)
+            self._report(job, errors)
+
+            if any(e.kind == "budget_exhausted" for e in errors):
+                for skipped_job in self._scheduler.stop():
+                    with self._progress_lock:
+                        self._progress[skipped_job.project.name].skipped += 1
+
+    def run(self) -> Dict[str, ProjectProgress]:
+        workers = [threading.Thread(target=self._worker, name=f"worker-{i}") for i in range(self._conf.workers)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        return self._progress
+
+    def print_summary(self):
+        print("\nSummary:")
+        for name, progress in self._progress.items():
+            usage = self._sessions[name].usage
+            print(f"  {name}: {progress.done}/{progress.total} done, {progress.failed} failed, {progress.skipped} skipped, "
+                  f"{usage.summary()}")
+
+        used = self.budget.used
+        cached_tokens = sum(session.usage.cached_tokens for session in self._sessions.values())
+        cache_hit_ratio = cached_tokens / used.prompt_tokens if used.prompt_tokens else 0.0
+        print(f"  Total: {used.requests} requests, {used.prompt_tokens} prompt tokens ({100 * cache_hit_ratio:.0f}% cache hits), "
+              f"{used.completion_tokens} completion tokens")
+
+
+def _parse_args() -> JobRunnerConfig:
+
+    parser = argparse.ArgumentParser(description="Localizes the .swift files and translates the Localizable.xcstrings catalogs of several projects described in a manifest. All projects share one OpenAI rate limit and budget. Files are modified in-place.")
+    parser.add_argument("manifest", help="Path to a JSON manifest listing the projects. See run_jobs.py for the format.")
+    parser.add_argument("--workers", type=int, default=2, help="Number of jobs that are processed concurrently.")
+    parser.add_argument("--max-requests", type=int, default=None, help="Stop starting new jobs after this many requests in total. Overrides the manifest's budget.")
+    parser.add_argument("--max-tokens", type=int, default=None, help="Stop starting new jobs after this many tokens in total. Overrides the manifest's budget.")
+    add_common_args(parser)
+
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.manifest):
+        print(f"Manifest not found: {args.manifest}\nAborting.")
+        exit(1)
+
+    try:
+        manifest = load_manifest(args.manifest)
+    except L10nError as e:
+        print(e.message)
+        print("Aborting.")
+        exit(1)
+    budget = manifest.get("budget", {})
+
+    if not args.no_confirmation:
+        if not user_approved_overwrite_warning():
+            # User aborted the execution
+            exit(1)
+
+    conf = JobRunnerConfig(
+        manifest_path = args.manifest,
+        projects = manifest["projects"],
+        workers = args.workers,
+        openai_api_cooldown = args.openai_api_cooldown,
+        log_path = args.log_path,
+        max_requests = args.max_requests if args.max_requests is not None else budget.get("max_requests"),
+        max_tokens = args.max_tokens if args.max_tokens is not None else budget.get("max_tokens"),
+        profile = args.profile,
+        profile_cprofile = args.profile_cprofile,
+        hedge_percentile = args.hedge_percentile,
+        hedge_max_ratio = args.hedge_max_ratio,
+        max_retries = args.max_retries,
+        record_path = args.record,
+        replay_path = args.replay,
+        replay_fall_through = args.replay_fall_through
+    )
+
+    return conf
+
+
+def main():
+
+    log_to_stdout()
+    conf = _parse_args()
+
+    try:
+        transport = create_transport(conf.record_path, conf.replay_path, conf.replay_fall_through)
+    except L10nError as e:
+        print(e.message)
+        print("Aborting.")
+        exit(1)
+
+    runner = JobRunner(conf, get_openapi_token(required=transport is None or not transport.is_offline), transport)
+
+    with profiling(conf.profile, conf.log_path, conf.profile_cprofile):
+        progress = runner.run()
+
+    runner.print_summary()
+    if transport is not None:
+        print(transport.summary())
+        transport.close()
+
+    if any(p.failed or p.skipped for p in progress.values()):
+        exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,176 @@
+
+import os
+import sys
+import time
+import openai
+import pytest
+from types import SimpleNamespace
+from utils import make_response, make_api_error, make_chat_gpt
+
+SCRIPT_FOLDER_PATH = os.path.dirname(os.path.realpath(__file__))
+
+sys.path.append(os.path.dirname(SCRIPT_FOLDER_PATH))
+from chat_gpt_interface import HedgingPolicy, RateLimiter, UsageBudget, BudgetExhaustedError, DeadlineExceededError
+from retry_policy import RetryPolicy, CircuitBreaker, server_retry_hint
+
+
+def test_slow_request_is_hedged(tmp_path):
+    hedging = HedgingPolicy(percentile=0.9, max_hedge_ratio=0.5, min_samples=3)
+    replies = [(0.01, "fast")] * 3 + [(2.0, "straggler"), (0.01, "hedge")]
+    cpt = make_chat_gpt(replies, log_path=str(tmp_path), hedging=hedging)
+
+    for _ in range(3):
+        assert cpt.complete_query("system", "user") == "fast"
+
+    start = time.time()
+    assert cpt.complete_query("system", "user") == "hedge"
+    assert time.time() - start < 1.0
+    assert cpt.client.chat.completions.calls == 5
+
+
+def test_hedge_waits_for_a_valid_response(tmp_path):
+    hedging = HedgingPolicy(percentile=0.9, max_hedge_ratio=0.5, min_samples=3)
+    replies = [(0.01, "valid")] * 3 + [(0.5, "valid"), (0.01, "invalid")]
+    cpt = make_chat_gpt(replies, log_path=str(tmp_path), hedging=hedging)
+    is_valid = lambda response: response == "valid"
+
+    for _ in range(3):
+        cpt.complete_query("system", "user", is_valid)
+
+    # the invalid hedge arrives first but must not win
+    assert cpt.complete_query("system", "user", is_valid) == "valid"
+    assert cpt.client.chat.completions.calls == 5
+    # both requests of the hedged query are charged
+    assert cpt.usage.requests == 5
+
+
+def test_hedge_is_skipped_without_a_free_rate_limit_slot(tmp_path):
+    hedging = HedgingPolicy(percentile=0.9, max_hedge_ratio=0.5, min_samples=3)
+    replies = [(0.01, "fast")] * 3 + [(0.5, "slow"), (0.01, "hedge")]
+    cpt = make_chat_gpt(replies, log_path=str(tmp_path), hedging=hedging)
+
+    for _ in range(3):
+        cpt.complete_query("system", "user")
+
+    # The query takes the only slot of the next 3 secs, the hedge must not wait for another one
+    cpt._rate_limiter = RateLimiter(3)
+    start = time.time()
+    assert cpt.complete_query("system", "user") == "slow"
+    assert time.time() - start < 1.0
+    assert cpt.client.chat.completions.calls == 4
+
+
+def test_hedge_rate_is_capped(tmp_path):
+    hedging = HedgingPolicy(percentile=0.9, max_hedge_ratio=0.1, min_samples=3)
+    replies = [(0.01, "fast")] * 3 + [(0.2, "slow")]
+    cpt = make_chat_gpt(replies, log_path=str(tmp_path), hedging=hedging)
+
+    for _ in range(3):
+        cpt.complete_query("system", "user")
+
+    # 1 hedge for 4 requests would exceed the ratio of 0.1
+    assert cpt.complete_query("system", "user") == "slow"
+    assert cpt.client.chat.completions.calls == 4
+
+
+def test_transient_errors_are_retried(tmp_path):
+    replies = [
+        (0, make_api_error(openai.RateLimitError, 429, {"retry-after-ms": "10"})),
+        (0, make_api_error(openai.InternalServerError, 503)),
+        (0, "ok"),
+    ]
+    retry_policy = RetryPolicy(max_retries=2, base_delay_sec=0.01)
+    cpt = make_chat_gpt(replies, log_path=str(tmp_path), retry_policy=retry_policy, circuit_breaker=CircuitBreaker(reset_timeout_sec=0))
+
+    assert cpt.complete_query("system", "user") == "ok"
+    assert cpt.client.chat.completions.calls == 3
+
+
+def test_invalid_retry_after_header_is_ignored(tmp_path):
+    assert server_retry_hint(make_api_error(openai.RateLimitError, 429, {"retry-after": "garbage"})) is None
+    assert server_retry_hint(make_api_error(openai.RateLimitError, 429, {"retry-after": "2"})) == 2.0
+
+    replies = [(0, make_api_error(openai.RateLimitError, 429, {"retry-after": "garbage"})), (0, "ok")]
+    retry_policy = RetryPolicy(max_retries=1, base_delay_sec=0.01)
+    cpt = make_chat_gpt(replies, log_path=str(tmp_path), retry_policy=retry_policy)
+
+    assert cpt.complete_query("system", "user") == "ok"
+
+
+def test_retries_respect_deadline_and_budget(tmp_path):
+    replies = [(0, make_api_error(openai.RateLimitError, 429, {"retry-after": "30"})), (0, "ok")]
+    cpt = make_chat_gpt(replies, log_path=str(tmp_path))
+
+    start = time.time()
+    with pytest.raises(DeadlineExceededError):
+        cpt.complete_query("system", "user", deadline=time.time() + 5)
+    assert time.time() - start < 1
+    assert cpt.client.chat.completions.calls == 1
+
+    budget = UsageBudget(max_requests=1)
+
+    def used_up_by_another_worker(messages):
+        budget.charge(100, 100)
+        raise make_api_error(openai.InternalServerError, 503)
+
+    cpt = make_chat_gpt([(0, used_up_by_another_worker), (0, "ok")], log_path=str(tmp_path), budget=budget)
+    with pytest.raises(BudgetExhaustedError):
+        cpt.complete_query("system", "user")
+    assert cpt.client.chat.completions.calls == 1
+
+
+def test_fatal_errors_are_not_retried(tmp_path):
+    replies = [(0, make_api_error(openai.AuthenticationError, 401)), (0, "ok")]
+    cpt = make_chat_gpt(replies, log_path=str(tmp_path), retry_policy=RetryPolicy(base_delay_sec=0.01))
+
+    with pytest.raises(openai.AuthenticationError):
+        cpt.complete_query("system", "user")
+    assert cpt.client.chat.completions.calls == 1
+
+    breaker = CircuitBreaker(failure_threshold=1)
+    replies = [(0, make_api_error(openai.RateLimitError, 429, code="insufficient_quota")), (0, "ok")]
+    cpt = make_chat_gpt(replies, log_path=str(tmp_path), retry_policy=RetryPolicy(base_delay_sec=0.01), circuit_breaker=breaker)
+
+    with pytest.raises(openai.RateLimitError):
+        cpt.complete_query("system", "user")
+    assert cpt.client.chat.completions.calls == 1
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_retries_go_through_the_rate_limiter(tmp_path):
+    replies = [(0, make_api_error(openai.InternalServerError, 503)), (0, "ok")]
+    cpt = make_chat_gpt(replies, log_path=str(tmp_path), retry_policy=RetryPolicy(base_delay_sec=0.01),
+                        rate_limiter=RateLimiter(0.5))
+
+    start = time.time()
+    assert cpt.complete_query("system", "user") == "ok"
+    assert time.time() - start >= 0.4
+
+
+def test_circuit_breaker_pauses_after_consecutive_failures():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout_sec=0.2)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    start = time.time()
+    breaker.wait_until_closed()
+    assert time.time() - start >= 0.15
+    # the first caller after the pause is let through as a probe
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_cached_prompt_tokens_are_counted(tmp_path):
+    cpt = make_chat_gpt([(0, "ok")], log_path=str(tmp_path))
+    response = make_response("ok")
+    response.usage = SimpleNamespace(prompt_tokens=2000, completion_tokens=10,
+                                     prompt_tokens_details=SimpleNamespace(cached_tokens=1536))
+    cpt.client.chat.completions.create = lambda **kwargs: response
+
+    assert cpt.complete_query("system", "user") == "ok"
+    assert cpt.usage.cached_tokens == 1536
+    assert cpt.usage.cache_hit_ratio == pytest.approx(0.768)
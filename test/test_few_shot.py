@@ -0,0 +1,82 @@
+
+import os
+import sys
+
+SCRIPT_FOLDER_PATH = os.path.dirname(os.path.realpath(__file__))
+
+sys.path.append(os.path.dirname(SCRIPT_FOLDER_PATH))
+from add_localization import build_example_index, build_swift_localization_command
+from few_shot import wrap_long_string_calls
+
+
+def test_examples_are_selected_by_swift_constructs():
+    index = build_example_index(token_budget=1500)
+
+    with open(os.path.join(SCRIPT_FOLDER_PATH, "simple_example/SettingsView_non-localized.swift")) as f:
+        settings_view = f.read()
+    selected = [e.name for e in index.select(settings_view)]
+    assert "FormControls" in selected
+
+    alert_source = '.alert("Oops", isPresented: $showingError) { Button("OK", role: .cancel) { } }'
+    assert index.select(alert_source)[0].name == "Alert"
+
+
+def test_examples_stay_within_token_budget():
+    index = build_example_index(token_budget=300)
+
+    with open(os.path.join(SCRIPT_FOLDER_PATH, "simple_example/SettingsView_non-localized.swift")) as f:
+        selected = index.select(f.read())
+
+    assert sum(e.tokens for e in selected) <= 300
+    assert index.savings.files == 1
+    assert index.savings.saved_tokens > 0
+
+
+def test_prompt_with_examples_is_smaller_than_with_reference_pair():
+    index = build_example_index()
+    swift_source = 'Text("Hello")'
+
+    full_system_command, _ = build_swift_localization_command(swift_source)
+    examples_system_command, user_input = build_swift_localization_command(swift_source, examples=index.select(swift_source))
+
+    assert user_input == swift_source
+    assert "PinEntryView" in full_system_command and "PinEntryView" not in examples_system_command
+    assert len(examples_system_command) < len(full_system_command) / 2
+
+
+def test_long_string_calls_are_wrapped():
+    short = 'Text(String(localized: "Settings", comment: "Title"))'
+    assert wrap_long_string_calls(short) == short
+
+    long = '    Text(String(localized: "Welcome back, \\(name)!", comment: "Greeting at the top of the home screen with the first name."))'
+    assert wrap_long_string_calls(long) == (
+        '    Text(String(\n'
+        '        localized: "Welcome back, \\(name)!",\n'
+        '        comment: "Greeting at the top of the home screen with the first name."\n'
+        '    ))'
+    )
+
+
+def test_examples_follow_the_line_mode():
+    """
+    The examples must not contradict the instructions about line breaks.
+    """
+
+    for example in build_example_index().examples:
+        single_line = example.localized_for(True)
+        assert single_line.count("\n") == example.not_localized.count("\n"), example.name
+        assert "String(\n" not in single_line, example.name
+
+        for line in example.localized_for(False).split("\n"):
+            assert len(line) <= 100 or "String(localized:" not in line, example.name
+
+    index = build_example_index()
+    examples = [e for e in index.examples if e.name == "Alert"]
+    swift_source = 'Text("Hello")'
+
+    single_line, _ = build_swift_localization_command(swift_source, True, examples)
+    multi_line, _ = build_swift_localization_command(swift_source, False, examples)
+
+    assert 'String(localized: "Delete Item?", comment:' in single_line
+    assert 'String(\n    localized: "Delete Item?",\n' in multi_line
+    assert 'String(localized:' not in multi_line.split("Example 1 with")[1]
@@ -0,0 +1,116 @@
+
+import os
+import sys
+import json
+from utils import install_fake_client, echo_translation
+
+SCRIPT_FOLDER_PATH = os.path.dirname(os.path.realpath(__file__))
+
+sys.path.append(os.path.dirname(SCRIPT_FOLDER_PATH))
+import l10n_api
+from l10n_api import L10nSession, L10nApiConfig
+from retry_policy import RetryPolicy
+
+
+def make_session(**kwargs) -> L10nSession:
+    config = L10nApiConfig(openai_token="test-token", cooldown_duration_sec=0, retry_policy=RetryPolicy(max_retries=0), **kwargs)
+    return L10nSession(config)
+
+
+def load_catalog():
+    with open(os.path.join(SCRIPT_FOLDER_PATH, "localizable_strings/Localizable.xcstrings")) as f:
+        return json.loads(f.read())
+
+
+def test_translate_catalog_without_touching_the_input():
+    session = make_session()
+    install_fake_client(session.chat_gpt, [(0, echo_translation)] * 2)
+    catalog = load_catalog()
+
+    result = session.translate_catalog(catalog, "de")
+
+    assert result.ok
+    assert len(result.translated_keys) == len(catalog["strings"])
+    assert "localizations" not in catalog["strings"]["Settings"]
+    assert result.catalog["strings"]["Settings"]["localizations"]["de"]["stringUnit"]["value"] == "DE Settings"
+    assert set(result.fingerprints["de"].keys()) == set(catalog["strings"].keys())
+
+
+def test_identical_queries_are_answered_from_the_session_cache():
+    session = make_session()
+    fake = install_fake_client(session.chat_gpt, [(0, echo_translation)] * 2)
+    catalog = load_catalog()
+
+    first = session.translate_catalog(catalog, "de")
+    second = session.translate_catalog(catalog, "de")
+
+    assert first.catalog == second.catalog
+    assert fake.calls == 2
+
+
+def test_session_cache_is_bounded():
+    # The catalog needs two queries, only the last one is kept
+    session = make_session(response_cache_size=1)
+    fake = install_fake_client(session.chat_gpt, [(0, echo_translation)] * 4)
+    catalog = load_catalog()
+
+    session.translate_catalog(catalog, "de")
+    session.translate_catalog(catalog, "de")
+
+    assert len(session.response_cache) == 1
+    assert fake.calls == 4
+
+    assert make_session(response_cache_size=0).response_cache is None
+
+
+def test_session_does_not_print(capsys):
+    session = make_session()
+    install_fake_client(session.chat_gpt, [(0, echo_translation)] * 2)
+
+    assert session.translate_catalog(load_catalog(), "de").ok
+    assert capsys.readouterr().out == ""
+
+
+def test_errors_are_returned_instead_of_exiting():
+    session = make_session()
+    install_fake_client(session.chat_gpt, [(0, "not a translation")] * 3)
+
+    result = session.translate_catalog(load_catalog(), "de", name="Localizable.xcstrings")
+
+    assert not result.ok
+    assert result.errors[0].kind == "invalid_response"
+    assert result.errors[0].path == "Localizable.xcstrings"
+
+    result = session.localize_swift_source('Text("Hello")')
+    assert result.ok
+    assert result.swift_source == "not a translation"
+
+
+def test_invalid_input_is_reported_as_error():
+    session = make_session()
+    install_fake_client(session.chat_gpt, [])
+
+    result = session.translate_catalog({"strings": {}}, "de", name="broken.xcstrings")
+    assert not result.ok
+    assert result.errors[0].kind == "invalid_input"
+    assert result.errors[0].path == "broken.xcstrings"
+
+    catalog = load_catalog()
+    catalog["strings"]["Settings"] = None
+    assert session.translate_catalog(catalog, "de").errors[0].kind == "invalid_input"
+
+    assert session.localize_swift_source(None).errors[0].kind == "invalid_input"
+
+
+def test_bugs_are_reported_as_internal_errors(monkeypatch):
+    session = make_session()
+
+    def broken_translate_strings(*args):
+        return None.missing
+
+    monkeypatch.setattr(l10n_api, "translate_strings", broken_translate_strings)
+    error = session.translate_catalog(load_catalog(), "de").errors[0]
+
+    assert error.kind == "internal_error"
+    assert isinstance(error.__cause__, AttributeError)
+    assert "broken_translate_strings" in error.message
@@ -0,0 +1,81 @@
+
+import os
+import sys
+
+SCRIPT_FOLDER_PATH = os.path.dirname(os.path.realpath(__file__))
+
+sys.path.append(os.path.dirname(SCRIPT_FOLDER_PATH))
+from placeholders import templatize, substitute, has_each_placeholder_once
+from translate_localization import TranslateL10nConfig, build_gpt_translatable_objects
+
+
+def test_templatize_numbers_and_format_specifiers():
+    """
+    Numbers and format specifiers become typed placeholders, other text and
+    digits inside words stay untouched.
+    """
+
+    assert templatize("Version 1.0.3") == ("Version {num1}", ["1.0.3"])
+    assert templatize("%lld items") == ("{int1} items", ["%lld"])
+    assert templatize("%1$@ invited you to %2$@") == ("{str1} invited you to {str2}", ["%1$@", "%2$@"])
+    assert templatize("Enable 2FA on iOS17") == ("Enable 2FA on iOS17", [])
+    assert templatize("100%% done in %.1f s") == ("{num1}%% done in {float2} s", ["100", "%.1f"])
+    assert templatize("Save 20% on all items") == ("Save {num1}% on all items", ["20"])
+    assert templatize("100% sure") == ("{num1}% sure", ["100"])
+
+
+def test_substitute_restores_values():
+    template, values = templatize("Version 1.0.3 of %@")
+    assert substitute("{str2}: Version {num1}", values) == "%@: Version 1.0.3"
+
+
+def test_reordered_specifiers_become_positional():
+    template, values = templatize("%@ invited %@")
+    assert template == "{str1} invited {str2}"
+    assert substitute("{str1} hat {str2} eingeladen", values) == "%@ hat %@ eingeladen"
+    assert substitute("{str2} hat {str1} eingeladen", values) == "%2$@ hat %1$@ eingeladen"
+
+    # numbers are not arguments and don't count for the positions
+    template, values = templatize("Level 3: %@ of %lld")
+    assert substitute("{int3} von {str2}, Stufe {num1}", values) == "%2$lld von %1$@, Stufe 3"
+
+
+def test_placeholder_validation():
+    assert has_each_placeholder_once("{int1} items", "{int1} Elemente")
+    assert not has_each_placeholder_once("{int1} items", "Elemente")
+    assert not has_each_placeholder_once("{int1} items", "{int1} {int1} Elemente")
+    assert not has_each_placeholder_once("{int1} items", "{int1} {str2} Elemente")
+
+
+def test_keys_are_grouped_by_template():
+    """
+    Keys that only differ in numbers are translated once and each key gets the
+    translation with its own values.
+    """
+
+    strings_dict = {
+        "Version 1.0.3": {"comment": "Version label"},
+        "Version 2.1": {"comment": "Version label"},
+        "Settings": {"comment": "Title"},
+    }
+    conf = TranslateL10nConfig("de", "", 0, "", "", False)
+
+    translatables = build_gpt_translatable_objects(conf, strings_dict)
+    assert [t.template for t in translatables] == ["Version {num1}", "Settings"]
+
+    assert not translatables[0].parse_gpt_response("translation: Fassung", "de")
+    assert translatables[0].parse_gpt_response("translation: Fassung {num1}", "de")
+    assert strings_dict["Version 1.0.3"]["localizations"]["de"]["stringUnit"]["value"] == "Fassung 1.0.3"
+    assert strings_dict["Version 2.1"]["localizations"]["de"]["stringUnit"]["value"] == "Fassung 2.1"
+
+
+def test_keys_with_different_comments_are_not_grouped():
+    strings_dict = {
+        "Level 1": {"comment": "Game level label"},
+        "Level 2": {"comment": "Water level in percent"},
+    }
+    conf = TranslateL10nConfig("de", "", 0, "", "", False)
+
+    translatables = build_gpt_translatable_objects(conf, strings_dict)
+    assert [t.key for t in translatables] == ["Level 1", "Level 2"]
+    assert "Water level in percent" in translatables[1].get_gpt_query()
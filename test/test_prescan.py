@@ -0,0 +1,59 @@
+
+import os
+import sys
+
+SCRIPT_FOLDER_PATH = os.path.dirname(os.path.realpath(__file__))
+
+sys.path.append(os.path.dirname(SCRIPT_FOLDER_PATH))
+import prescan
+from prescan import has_localizable_candidates, find_files_with_candidates
+
+
+def test_ui_strings_are_candidates():
+    assert has_localizable_candidates(b'Text("Hello")')
+    assert has_localizable_candidates(b'let title = """\n  Welcome\n  """')
+    assert has_localizable_candidates(b'state = .error("Could not load the list")')
+
+    with open(os.path.join(SCRIPT_FOLDER_PATH, "simple_example/SettingsView_non-localized.swift"), "rb") as f:
+        assert has_localizable_candidates(f.read())
+
+
+def test_localized_logged_and_commented_strings_are_ignored():
+    source = b'''
+    // Text("Commented out")
+    /* Button("Also commented out") { } */
+    let title = String(localized: "Settings", comment: "Title of the settings page")
+    let other = NSLocalizedString("Done", comment: "Button")
+    Text(verbatim: "v1.0")
+    print("Loaded \\(items.count) items")
+    logger.debug("Request failed: \\(String(describing: error))")
+    os_log("Started", log: .default, type: .info)
+    let separator = " - "
+    Image(systemName: "heart.fill")
+    UserDefaults.standard.set(true, forKey: "didShowOnboarding")
+    let pin = String(format: "%04d", value)
+    let empty = ""
+    '''
+    assert not has_localizable_candidates(source)
+    assert has_localizable_candidates(source + b'Text("Visible")')
+    assert not has_localizable_candidates(b'struct Item: Codable { let id: Int }')
+
+
+def test_only_logger_receivers_count_as_logging():
+    assert not has_localizable_candidates(b'Logger.info("Started")')
+    assert not has_localizable_candidates(b'Self.logger.error("Failed")')
+    assert has_localizable_candidates(b'dialog.error("Could not save the file")')
+    assert has_localizable_candidates(b'catalog.info("New items available")')
+
+
+def test_files_are_scanned_in_order(tmp_path, monkeypatch):
+    # Large files are memory-mapped
+    monkeypatch.setattr(prescan, "MMAP_THRESHOLD_BYTES", 64)
+
+    paths = []
+    for name, content in [("Model.swift", "struct Model {}\n" * 20), ("View.swift", 'Text("Hi")\n' * 20), ("Empty.swift", "")]:
+        path = tmp_path / name
+        path.write_text(content)
+        paths.append(str(path))
+
+    assert find_files_with_candidates(paths, max_workers=2) == [False, True, False]
@@ -0,0 +1,102 @@
+
+import os
+import sys
+import json
+import pytest
+import time
+import datetime
+import subprocess
+from utils import install_fake_client, echo_translation
+
+SCRIPT_FOLDER_PATH = os.path.dirname(os.path.realpath(__file__))
+
+sys.path.append(os.path.dirname(SCRIPT_FOLDER_PATH))
+from chat_gpt_interface import ChatGPT, UsageBudget
+from translate_localization import TranslateL10nConfig, TranslationStopped, build_gpt_translatable_objects, translate_strings
+from priorities import find_recently_changed_swift_files, collect_referenced_keys
+
+
+def test_strings_are_ordered_by_priority(tmp_path):
+    swift_path = tmp_path / "ProfileView.swift"
+    swift_path.write_text('Text("Hello \\(user.name)")\nText("Sign out")\n')
+    old_path = tmp_path / "OldView.swift"
+    old_path.write_text('Text("Help")\n')
+    os.utime(old_path, (0, 0))
+
+    recent_files = find_recently_changed_swift_files(str(tmp_path), max_age_days=14)
+    assert recent_files == [str(swift_path)]
+    recent_keys = collect_referenced_keys(recent_files)
+
+    def translated(language="fr", state="translated"):
+        return {"localizations": {language: {"stringUnit": {"state": state, "value": "..."}}}}
+
+    strings_dict = {
+        "Help": {"comment": "Button", **translated()},
+        "Flagged": {"comment": "Title", **translated("de", "needs_review")},
+        "Hello %@": {"comment": "Greeting", **translated()},
+        "Only in English": {"comment": "Title", **translated("en")},
+        "Sign out": {"comment": "Button", **translated("de", "stale")},
+    }
+    conf = TranslateL10nConfig("de", "", 0, "", "", False)
+
+    translatables = build_gpt_translatable_objects(conf, strings_dict, source_language="en", recent_keys=recent_keys)
+    assert [t.key for t in translatables] == ["Only in English", "Hello %@", "Sign out", "Flagged", "Help"]
+
+
+def test_recently_changed_files_are_taken_from_git(tmp_path):
+    def git(*args, date="2020-01-01T12:00:00"):
+        env = {**os.environ, "GIT_AUTHOR_DATE": date, "GIT_COMMITTER_DATE": date}
+        subprocess.run(["git", "-C", str(tmp_path), "-c", "user.name=Test", "-c", "user.email=test@example.com", *args],
+                       check=True, capture_output=True, env=env)
+
+    for name in ("OldView.swift", "RecentView.swift", "EditedView.swift"):
+        (tmp_path / name).write_text('Text("Hi")\n')
+    git("init")
+    git("add", "OldView.swift", "EditedView.swift")
+    git("commit", "-m", "old")
+    git("add", "RecentView.swift")
+    two_days_ago = (datetime.datetime.now() - datetime.timedelta(days=2)).strftime("%Y-%m-%dT%H:%M:%S")
+    git("commit", "-m", "recent", date=two_days_ago)
+    (tmp_path / "EditedView.swift").write_text('Text("Hello")\n')
+    (tmp_path / "NewView.swift").write_text('Text("New")\n')
+
+    # all files have a fresh modification time, only Git knows which changed
+    recent_files = {os.path.basename(p) for p in find_recently_changed_swift_files(str(tmp_path), max_age_days=14)}
+    assert recent_files == {"RecentView.swift", "EditedView.swift", "NewView.swift"}
+
+
+def test_stopped_run_keeps_the_finished_batches(tmp_path):
+    with open(os.path.join(SCRIPT_FOLDER_PATH, "localizable_strings/Localizable.xcstrings")) as f:
+        catalog = json.loads(f.read())
+
+    cpt = ChatGPT("test-token", log_path=None, cooldown_duration_sec=0, budget=UsageBudget(max_requests=1))
+    install_fake_client(cpt, [(0, echo_translation)] * 2)
+    conf = TranslateL10nConfig("de", "", 0, "", "", False)
+    fingerprints = {}
+
+    with pytest.raises(TranslationStopped) as stopped:
+        translate_strings(cpt, catalog, conf, fingerprints)
+
+    assert stopped.value.kind == "budget_exhausted"
+    assert len(stopped.value.translated) == 10
+    translated_keys = [key for key, info in catalog["strings"].items() if "de" in info.get("localizations", {})]
+    assert set(translated_keys) == set(fingerprints["de"].keys())
+    assert len(translated_keys) >= 10
+
+
+def test_deadline_is_checked_before_the_rate_limit_wait():
+    with open(os.path.join(SCRIPT_FOLDER_PATH, "localizable_strings/Localizable.xcstrings")) as f:
+        catalog = json.loads(f.read())
+
+    # the second batch would have to wait 60 secs for the rate limit
+    cpt = ChatGPT("test-token", log_path=None, cooldown_duration_sec=60)
+    install_fake_client(cpt, [(0, echo_translation)] * 2)
+    conf = TranslateL10nConfig("de", "", 0, "", "", False, deadline_sec=5)
+
+    start = time.time()
+    with pytest.raises(TranslationStopped) as stopped:
+        translate_strings(cpt, catalog, conf, {})
+
+    assert time.time() - start < 1
+    assert stopped.value.kind == "deadline"
+    assert len(stopped.value.translated) == 10
@@ -0,0 +1,67 @@
+
+import os
+import sys
+import json
+import shutil
+import pytest
+from utils import install_fake_client, echo_translation
+
+SCRIPT_FOLDER_PATH = os.path.dirname(os.path.realpath(__file__))
+
+sys.path.append(os.path.dirname(SCRIPT_FOLDER_PATH))
+from common import L10nError
+from run_jobs import FairScheduler, Job, JobRunner, JobRunnerConfig, load_manifest
+
+
+def test_scheduler_shares_turns_by_priority():
+    jobs = {
+        "a": [Job(None, "localize", f"a{i}.swift") for i in range(6)],
+        "b": [Job(None, "localize", f"b{i}.swift") for i in range(6)],
+    }
+    scheduler = FairScheduler(jobs, {"a": 2, "b": 1})
+
+    order = [scheduler.next_job().path[0] for _ in range(6)]
+    assert order.count("a") == 4 and order.count("b") == 2
+
+    remaining = scheduler.stop()
+    assert len(remaining) == 6
+    assert scheduler.next_job() is None
+
+
+def test_projects_are_translated_under_one_budget(tmp_path):
+    for name in ["app_1", "app_2"]:
+        os.makedirs(tmp_path / name)
+        shutil.copy(os.path.join(SCRIPT_FOLDER_PATH, "localizable_strings/Localizable.xcstrings"), tmp_path / name)
+
+    manifest_path = tmp_path / "manifest.json"
+    with open(manifest_path, "w") as f:
+        f.write(json.dumps({"projects": [
+            {"name": "app_1", "catalogs": ["app_1/Localizable.xcstrings"], "target_languages": ["de", "fr"]},
+            {"name": "app_2", "catalogs": ["app_2/Localizable.xcstrings"], "target_languages": ["de"]},
+        ]}))
+
+    manifest = load_manifest(str(manifest_path))
+    conf = JobRunnerConfig(str(manifest_path), manifest["projects"], workers=2, openai_api_cooldown=0, log_path=str(tmp_path / "queries"))
+    runner = JobRunner(conf, "test-token")
+    for session in runner._sessions.values():
+        install_fake_client(session.chat_gpt, [(0, echo_translation)] * 4)
+
+    progress = runner.run()
+
+    assert progress["app_1"].done == 2 and progress["app_2"].done == 1
+    assert runner.budget.used.requests == 6
+
+    with open(tmp_path / "app_1" / "Localizable.xcstrings") as f:
+        localizations = json.loads(f.read())["strings"]["Settings"]["localizations"]
+    assert set(localizations.keys()) == {"de", "fr"}
+
+
+def test_unknown_manifest_keys_are_reported(tmp_path):
+    manifest_path = tmp_path / "manifest.json"
+    with open(manifest_path, "w") as f:
+        f.write(json.dumps({"projects": [{"name": "app", "catalog": "Localizable.xcstrings"}]}))
+
+    with pytest.raises(L10nError) as error:
+        load_manifest(str(manifest_path))
+    assert "catalog" in error.value.message
+    assert error.value.kind == "invalid_input"
@@ -0,0 +1,41 @@
+
+import os
+import sys
+import json
+import glob
+
+SCRIPT_FOLDER_PATH = os.path.dirname(os.path.realpath(__file__))
+
+sys.path.append(os.path.dirname(SCRIPT_FOLDER_PATH))
+import tracing
+from tracing import span, profiling
+
+
+def test_spans_are_written_as_chrome_trace(tmp_path):
+    with profiling(True, str(tmp_path), with_cprofile=True):
+        with span("outer", file="a.swift"):
+            with span("inner") as inner:
+                inner.annotate(tokens=42)
+
+    trace_files = glob.glob(os.path.join(tmp_path, "*.trace.json"))
+    assert len(trace_files) == 1
+    assert len(glob.glob(os.path.join(tmp_path, "*.prof"))) == 1
+
+    with open(trace_files[0]) as f:
+        events = json.loads(f.read())["traceEvents"]
+
+    spans = {e["name"]: e for e in events if e["ph"] == "X"}
+    assert set(spans.keys()) == {"run", "outer", "inner"}
+    assert spans["outer"]["args"] == {"file": "a.swift"}
+    assert spans["inner"]["args"] == {"tokens": 42}
+    assert spans["outer"]["dur"] >= spans["inner"]["dur"]
+    assert any(e["ph"] == "M" and e["name"] == "thread_name" for e in events)
+
+
+def test_spans_are_not_recorded_when_disabled(tmp_path):
+    with profiling(False, str(tmp_path)):
+        with span("outer") as s:
+            s.annotate(tokens=42)
+        assert tracing._active_tracer is None
+
+    assert os.listdir(tmp_path) == []
@@ -1,11 +1,15 @@
 
 
 import os
+import sys
 import json
 import pytest
 
 SCRIPT_FOLDER_PATH = os.path.dirname(os.path.realpath(__file__))
 
+sys.path.append(os.path.dirname(SCRIPT_FOLDER_PATH))
+from translate_localization import Translatable, TranslateL10nConfig, build_gpt_translatable_objects, build_translation_system_command
+
 GPT_RETRY_COUNT = 2
     
 
@@ -49,5 +53,45 @@ def test_translating_localizable():
 
             assert en_count == loc_count, f"Expected to find {en_count} {es}, but found {loc_count}\n" + \
                 f"English: {en_string}\nTranslated: {loc_string}"
-        
 
+
+def test_stale_translations_are_detected_by_fingerprint():
+    """
+    Only translations whose inputs changed or which Xcode flagged are queried
+    again. Translations without a fingerprint (e.g. made by hand) are kept.
+    """
+
+    def translated(state="translated"):
+        return {"localizations": {"de": {"stringUnit": {"state": state, "value": "..."}}}}
+
+    strings_dict = {
+        "Unchanged": {"comment": "Title", **translated()},
+        "Comment edited": {"comment": "New comment", **translated()},
+        "Manual": {"comment": "Title", **translated()},
+        "Flagged": {"comment": "Title", **translated("needs_review")},
+        "Missing": {"comment": "Title"},
+        "Stale": {"comment": "Title", "extractionState": "stale", **translated()},
+    }
+    fingerprints = {
+        "Unchanged": Translatable("Unchanged", {"comment": "Title"}).fingerprint,
+        "Comment edited": Translatable("Comment edited", {"comment": "Old comment"}).fingerprint,
+    }
+    conf = TranslateL10nConfig("de", "", 0, "", "", False)
+
+    # ordered by priority, see priorities.py
+    translatables = build_gpt_translatable_objects(conf, strings_dict, fingerprints)
+    assert [t.key for t in translatables] == ["Missing", "Flagged", "Comment edited", "Stale"]
+
+    # a different app context invalidates all translations made by this script
+    translatables = build_gpt_translatable_objects(conf, strings_dict, fingerprints, app_context="A todo app")
+    assert [t.key for t in translatables] == ["Missing", "Flagged", "Unchanged", "Comment edited", "Stale"]
+
+
+def test_system_command_starts_with_the_same_text_for_all_languages():
+    german = build_translation_system_command("en", "de", "A todo app")
+    french = build_translation_system_command("en", "fr", "A todo app")
+
+    shared = os.path.commonprefix([german, french])
+    assert "A todo app" in shared
+    assert german.index("The source language is") > german.index("A todo app")
+    assert german.endswith("The source language is en and the target language is de.\n")
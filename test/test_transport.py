@@ -0,0 +1,83 @@
+
+import os
+import sys
+import json
+import pytest
+from utils import install_fake_client, make_chat_gpt, echo_translation
+
+SCRIPT_FOLDER_PATH = os.path.dirname(os.path.realpath(__file__))
+
+sys.path.append(os.path.dirname(SCRIPT_FOLDER_PATH))
+from transport import RecordReplayTransport, ReplayMissError, RECORD, REPLAY
+from l10n_api import L10nSession, L10nApiConfig
+from retry_policy import RetryPolicy
+
+
+def test_recorded_responses_are_replayed_offline(tmp_path, monkeypatch):
+    store_path = str(tmp_path / "responses.jsonl")
+
+    recorder = RecordReplayTransport(store_path, RECORD)
+    cpt = make_chat_gpt([(0, "first"), (0, "second")], transport=recorder)
+    assert cpt.complete_query("system", "a") == "first"
+    assert cpt.complete_query("system", "b") == "second"
+    recorder.close()
+
+    # No API key and no replies are needed for replaying
+    monkeypatch.delenv("OPENAI_API_KEY", raising=False)
+    player = RecordReplayTransport(store_path, REPLAY)
+    cpt = make_chat_gpt(openai_token=None, transport=player)
+
+    assert cpt.complete_query("system", "b") == "second"
+    assert cpt.complete_query("system", "a") == "first"
+    assert cpt.client.chat.completions.calls == 0
+    assert cpt.usage.replayed == 2 and cpt.usage.requests == 0
+
+    with pytest.raises(ReplayMissError):
+        cpt.complete_query("system", "c")
+
+
+def test_retried_requests_are_replayed_in_order(tmp_path):
+    store_path = str(tmp_path / "responses.jsonl")
+    is_valid = lambda response: response == "valid"
+
+    recorder = RecordReplayTransport(store_path, RECORD)
+    cpt = make_chat_gpt([(0, "invalid"), (0, "valid")], transport=recorder)
+    assert cpt.complete_query("system", "user", is_valid) == "valid"
+    recorder.close()
+
+    cpt = make_chat_gpt(transport=RecordReplayTransport(store_path, REPLAY))
+    assert cpt.complete_query("system", "user", is_valid) == "valid"
+
+
+def test_misses_fall_through_to_the_api_and_are_added(tmp_path):
+    store_path = str(tmp_path / "responses.jsonl")
+
+    transport = RecordReplayTransport(store_path, REPLAY, fall_through=True)
+    cpt = make_chat_gpt([(0, "from api")], transport=transport)
+    assert cpt.complete_query("system", "user") == "from api"
+    assert cpt.complete_query("system", "user") == "from api"
+    assert cpt.client.chat.completions.calls == 1
+    assert transport.hits == 1 and transport.misses == 1
+    transport.close()
+
+    assert len(RecordReplayTransport(store_path, REPLAY).store) == 1
+
+
+def test_catalog_translation_can_be_replayed(tmp_path):
+    store_path = str(tmp_path / "responses.jsonl")
+    with open(os.path.join(SCRIPT_FOLDER_PATH, "localizable_strings/Localizable.xcstrings")) as f:
+        catalog = json.loads(f.read())
+
+    def translate(transport, replies):
+        config = L10nApiConfig(openai_token="test-token", cooldown_duration_sec=0, retry_policy=RetryPolicy(max_retries=0), transport=transport)
+        session = L10nSession(config)
+        install_fake_client(session.chat_gpt, replies)
+        result = session.translate_catalog(catalog, "de")
+        transport.close()
+        return result
+
+    recorded = translate(RecordReplayTransport(store_path, RECORD), [(0, echo_translation)] * 2)
+    replayed = translate(RecordReplayTransport(store_path, REPLAY), [])
+
+    assert recorded.ok and replayed.ok
+    assert replayed.catalog == recorded.catalog
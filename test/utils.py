@@ -2,6 +2,9 @@
 import re
 import os
 import sys
+import time
+import threading
+from types import SimpleNamespace
 from typing import List
 
 
@@ -40,3 +43,72 @@ def remove_newlines_in_parentheses(content: str):
     # Remove multiple consecutive spaces
     content = re.sub(r'\(([^)]*)\)', lambda m: '(' + m.group(1).replace('  ', '') + ')', content)
     return content
+
+
+def make_response(content: str, finish_reason: str = "stop"):
+    message = SimpleNamespace(content=content)
+    return SimpleNamespace(choices=[SimpleNamespace(finish_reason=finish_reason, message=message)], usage=None)
+
+
+def make_api_error(error_cls, status_code: int, headers: dict = None, code: str = None):
+    """
+    Builds an openai status error without going through the http client.
+    """
+    error = error_cls.__new__(error_cls)
+    Exception.__init__(error, f"status {status_code}")
+    error.status_code = status_code
+    error.code = code
+    error.response = SimpleNamespace(headers=headers or {})
+    return error
+
+
+class FakeCompletions:
+    """
+    Stands in for client.chat.completions. Each call pops the next
+    (delay, content) pair. If content is an exception, it is raised. If it
+    is callable, it is called with the messages to generate the content.
+    """
+
+    def __init__(self, replies):
+        self._replies = list(replies)
+        self._lock = threading.Lock()
+        self.calls = 0
+
+    def create(self, model, messages):
+        with self._lock:
+            delay, content = self._replies.pop(0)
+            self.calls += 1
+        time.sleep(delay)
+        if isinstance(content, Exception):
+            raise content
+        if callable(content):
+            content = content(messages)
+        return make_response(content)
+
+
+def install_fake_client(cpt, replies):
+    """
+    Replaces the OpenAI client of a ChatGPT instance by FakeCompletions.
+    """
+    cpt.client = SimpleNamespace(chat=SimpleNamespace(completions=FakeCompletions(replies)))
+    return cpt.client.chat.completions
+
+
+def make_chat_gpt(replies=(), openai_token: str = "test-token", log_path: str = None, **kwargs):
+    """
+    ChatGPT instance without cooldown that is answered by FakeCompletions.
+    kwargs are passed on to ChatGPT.
+    """
+    from chat_gpt_interface import ChatGPT
+
+    cpt = ChatGPT(openai_token, log_path=log_path, cooldown_duration_sec=0, **kwargs)
+    install_fake_client(cpt, replies)
+    return cpt
+
+
+def echo_translation(messages) -> str:
+    """
+    Fake model that "translates" each requested key by prefixing it with "DE ".
+    """
+    keys = re.findall(r"^key: (.*)$", messages[-1]["content"], flags=re.MULTILINE)
+    return "\n".join(f"translation: DE {k}" for k in keys)
@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+
+#
+# Marius Montebaur
+#
+# October 2023
+#
+# Lightweight span instrumentation. Spans are only recorded while profiling is
+# enabled (see profiling()), otherwise span() returns a shared no-op context.
+# The recorded spans are written in Chrome's trace event format and can be
+# viewed with chrome://tracing or https://ui.perfetto.dev
+#
+
+
+import os
+import json
+import time
+import cProfile
+import datetime
+import threading
+import contextlib
+from typing import Any, Dict, List
+
+
+class Tracer:
+
+    def __init__(self):
+        self._events: List[Dict[str, Any]] = []
+        self._lock = threading.Lock()
+        self._thread_names: Dict[int, str] = {}
+        self._pid = os.getpid()
+
+    def add_span(self, name: str, start: float, end: float, args: Dict[str, Any]):
+        """
+        start and end are time.perf_counter() values in seconds.
+        """
+        thread = threading.current_thread()
+        event = {
+            "name": name,
+            "ph": "X",
+            "ts": start * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": self._pid,
+            "tid": thread.ident,
+            "args": args,
+        }
+        with self._lock:
+            self._events.append(event)
+            self._thread_names.setdefault(thread.ident, thread.name)
+
+    def write_chrome_trace(self, path: str):
+        with self._lock:
+            metadata = [
+                {"name": "thread_name", "ph": "M", "pid": self._pid, "tid": tid, "args": {"name": name}}
+                for tid, name in self._thread_names.items()
+            ]
+            trace = {"traceEvents": metadata + self._events, "displayTimeUnit": "ms"}
+
+        with open(path, "w") as f:
+            f.write(json.dumps(trace, default=str))
+
+
+class _Span:
+
+    def __init__(self, tracer: Tracer, name: str, args: Dict[str, Any]):
+        self._tracer = tracer
+        self._name = name
+        self._args = args
+
+    def annotate(self, **args):
+        """
+        Attach additional args that are only known inside the span's body.
+        """
+        self._args.update(args)
+
+    def __enter__(self):
+        self._start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, exc_tb):
+        if exc_type is not None:
+            self._args["error"] = exc_type.__name__
+        self._tracer.add_span(self._name, self._start, time.perf_counter(), self._args)
+
+
+class _NullSpan:
+    """
+    Returned by span() while profiling is disabled. Keeps the same interface as
+    _Span so that callers can annotate unconditionally.
+    """
+
+    def annotate(self, **args):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, exc_tb):
+        return None
+
+
+_NULL_SPAN = _NullSpan()
+_active_tracer: Tracer = None
+
+
+def span(name: str, **args):
+    """
+    Context manager that records the time spent in its body as a span. Extra
+    keyword args are attached to the span. Near-zero cost if not profiling.
+
+    Usage:
+        with span("api_request", model=self.model):
+            ...
+    """
+    if _active_tracer is None:
+        return _NULL_SPAN
+    return _Span(_active_tracer, name, args)
+
+
+@contextlib.contextmanager
+def profiling(enabled: bool, output_folder: str, with_cprofile: bool = False):
+    """
+    Records all spans of the wrapped code and writes them as Chrome trace JSON
+    to output_folder. Optionally also runs cProfile and dumps its stats next to
+    the trace. Does nothing if enabled is False.
+    """
+    global _active_tracer
+
+    if not enabled:
+        yield
+        return
+
+    os.makedirs(output_folder, exist_ok=True)
+    date_str = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+    trace_path = os.path.join(output_folder, f"{date_str}_profile.trace.json")
+
+    _active_tracer = Tracer()
+    profiler = cProfile.Profile() if with_cprofile else None
+    if profiler:
+        profiler.enable()
+
+    try:
+        with span("run"):
+            yield
+    finally:
+        if profiler:
+            profiler.disable()
+            cprofile_path = os.path.join(output_folder, f"{date_str}_profile.prof")
+            profiler.dump_stats(cprofile_path)
+            print(f"cProfile stats written to: {cprofile_path}")
+
+        _active_tracer.write_chrome_trace(trace_path)
+        _active_tracer = None
+        print(f"Chrome trace written to: {trace_path}")
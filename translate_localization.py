@@ -10,27 +10,65 @@
 import os
 import glob
 import json
+import time
+import hashlib
+import logging
+import collections
+import functools
 import argparse
 from dataclasses import dataclass
-from typing import Dict, List
-from chat_gpt_interface import ChatGPT
-from common import get_app_context, get_openapi_token, add_common_args, user_approved_overwrite_warning
-
-
-def get_task_desc(source_lang: str, target_lang: str) -> str:
-    desc = f"""
-    I want you to translate some text from {source_lang} to {target_lang}.
-    This text will be used to offer an iOS app in different languages.
-    The input given to you will consist of three lines for each phrase that needs to be translated.
-    First, the phrase in {source_lang}.
-    Second, a comment that describes in which context the phrase is occurring in the application's UI. Make sure that the translation you provide fits this context.
-    Third, a line starting with "translation: " in which you should add your translation.
-        
-    Please return only the lines starting with "translation: " with your added translation after the colon.
-    Do not include the comments in the translations, those are only to add context.
-    "\\n" represent escaped newlines in the original string. Please keep the line breaks like this.
+from typing import Dict, Iterator, List, Set, Tuple
+from chat_gpt_interface import ChatGPT, HedgingPolicy, UsageBudget, BudgetExhaustedError, DeadlineExceededError
+from retry_policy import RetryPolicy
+from transport import RecordReplayTransport, create_transport
+from tracing import span, profiling
+from placeholders import templatize, substitute, has_each_placeholder_once
+from priorities import PRIORITY_NAMES, PRIORITY_OTHER, translation_priority, find_recently_changed_swift_files, collect_referenced_keys
+from common import L10nError, get_app_context, get_openapi_token, add_common_args, user_approved_overwrite_warning, log_to_stdout
+
+
+logger = logging.getLogger(__name__)
+
+
+# Bump whenever the task description or the query format changes in a way
+# that should invalidate existing translations (see compute_fingerprint).
+PROMPT_VERSION = 2
+
+
+# Does not mention the languages, so that it is the same for every run and the
+# provider's prompt cache can reuse it.
+task_desc = """
+I want you to translate some text from the source language to the target language that are named at the end of these instructions.
+This text will be used to offer an iOS app in different languages.
+The input given to you will consist of three lines for each phrase that needs to be translated.
+First, the phrase in the source language.
+Second, a comment that describes in which context the phrase is occurring in the application's UI. Make sure that the translation you provide fits this context.
+Third, a line starting with "translation: " in which you should add your translation.
+
+Please return only the lines starting with "translation: " with your added translation after the colon.
+Do not include the comments in the translations, those are only to add context.
+"\\n" represent escaped newlines in the original string. Please keep the line breaks like this.
+Placeholders in curly braces like {num1}, {int1} or {str1} stand for values that are inserted later. Keep every placeholder exactly once and unchanged in the translation.
+"""
+
+
+@functools.lru_cache(maxsize=None)
+def build_translation_system_command(source_lang: str, target_lang: str, app_context: str = None) -> str:
+    """
+    The system command is the same for all batches of a run. Building it once
+    keeps it byte-identical. The strings of a batch are sent as user input
+    after it.
+
+    Providers only cache prompt prefixes above a minimum length (1024 tokens
+    for OpenAI). The static task description comes first, followed by the app
+    context, which is the same for all languages, and the languages last. That
+    way, runs for different languages share the longest possible prefix.
     """
-    return desc.replace("    ", "")
+    system_cmd = task_desc
+    if app_context:
+        system_cmd += "\n" + app_context + "\n"
+    system_cmd += f"\nThe source language is {source_lang} and the target language is {target_lang}.\n"
+    return system_cmd
 
 
 def escape_char_while_parsing_localizable_strings(string: str) -> str:
@@ -40,22 +78,95 @@ def unescape_string_while_parsing_response(string: str) -> str:
     return string.replace("\\n", '\n')
 
 
+def compute_fingerprint(key: str, comment: str, app_context: str, prompt_version: int = PROMPT_VERSION) -> str:
+    """
+    Fingerprint of everything a translation was produced from. If any of those
+    inputs change, the stored translation is considered stale.
+    """
+    sha = hashlib.sha256()
+    for part in (key, comment or "", app_context or "", str(prompt_version)):
+        sha.update(part.encode("utf-8"))
+        sha.update(b"\0")
+    return sha.hexdigest()[:16]
+
+
+def get_fingerprints_path(localizable_path: str) -> str:
+    """
+    Fingerprints are kept next to the catalog instead of inside it since Xcode
+    rewrites the catalog and does not preserve unknown keys.
+    """
+    return os.path.splitext(localizable_path)[0] + ".fingerprints.json"
+
+
+def load_fingerprints(fingerprints_path: str) -> Dict[str, Dict[str, str]]:
+    """
+    Returns {language: {key: fingerprint}}. Empty if no file exists yet.
+    """
+    if not os.path.exists(fingerprints_path):
+        return {}
+    with open(fingerprints_path, "r") as f:
+        return json.loads(f.read())
+
+
+def save_fingerprints(fingerprints_path: str, fingerprints: Dict[str, Dict[str, str]]):
+    with open(fingerprints_path, "w") as f:
+        f.write(json.dumps(fingerprints, indent=2, sort_keys=True, ensure_ascii=False))
+
+
 class Translatable:
     """
     Represents a translatable string in the Localizable.xcstrings. This class is
     used to build a query for ChatGPT and to parse the response for this
     specific translatable string.
+
+    Numbers and format specifiers in the key are replaced by placeholders.
+    Keys that only differ in those values and have the same comment share one
+    Translatable, so the template is translated once and the values are
+    substituted back for each key (see add_variant).
     """
 
-    def __init__(self, key, info_dict):
-        self.escaped_key = escape_char_while_parsing_localizable_strings(key)
+    # String unit states set by Xcode for translations that need to be redone
+    STATES_NEEDING_WORK = ("stale", "needs_review")
+
+    def __init__(self, key, info_dict, app_context: str = None):
+        self.key = key
+        self.template, values = templatize(key)
+        self.escaped_key = escape_char_while_parsing_localizable_strings(self.template)
         self.info_dict = info_dict
-    
-    def is_translated_to(self, language: str):
-        if "localizations" in self.info_dict:
-            l10ns = self.info_dict["localizations"]
-            return language in l10ns.keys()
-        return False
+        self.fingerprint = compute_fingerprint(key, info_dict.get("comment"), app_context)
+        # (key, info_dict, placeholder values, fingerprint) for every key sharing this template
+        self.variants = [(key, info_dict, values, self.fingerprint)]
+        # See priorities.py, lower is translated first
+        self.priority = PRIORITY_OTHER
+
+    def add_variant(self, other: "Translatable"):
+        assert other.template == self.template, f"Key {other.key} does not match template {self.template}"
+        assert other.info_dict.get("comment") == self.info_dict.get("comment"), f"Key {other.key} has a different comment than {self.key}"
+        self.variants.extend(other.variants)
+        self.priority = min(self.priority, other.priority)
+
+    def is_translated_to(self, language: str, stored_fingerprint: str = None):
+        """
+        A translation only counts if it exists, was not flagged by Xcode and,
+        if it was produced by this script, its inputs did not change since.
+        Translations without a stored fingerprint (e.g. made by hand) are kept.
+        """
+        l10n = self.info_dict.get("localizations", {}).get(language)
+        if l10n is None:
+            return False
+
+        state = l10n.get("stringUnit", {}).get("state")
+        if state in self.STATES_NEEDING_WORK:
+            return False
+
+        # Xcode marks stale entries on the string itself, not on its translations
+        if self.info_dict.get("extractionState") == "stale":
+            return False
+
+        if stored_fingerprint is not None and stored_fingerprint != self.fingerprint:
+            return False
+
+        return True
     
     def get_gpt_query(self) -> str:
         query = f"key: {self.escaped_key}\n"
@@ -65,27 +176,32 @@ class Translatable:
         query += "translation: \n"
         return query
 
+    def is_valid_gpt_response(self, gpt_response: str) -> bool:
+        if not gpt_response.startswith("translation: "):
+            return False
+        return has_each_placeholder_once(self.template, gpt_response[len("translation: "):])
+
     def parse_gpt_response(self, gpt_response: str, for_language: str) -> bool:
         try:
-            translation = gpt_response
-            if not translation.startswith("translation: "):
+            if not self.is_valid_gpt_response(gpt_response):
                 return False
             
-            translation = translation[len("translation: "):]
-
-            localizations_dict_update = {
-                for_language: {
-                    "stringUnit": {
-                        "state": "translated",
-                        "value": unescape_string_while_parsing_response(translation)
+            translation = unescape_string_while_parsing_response(gpt_response[len("translation: "):])
+
+            for _, info_dict, values, _ in self.variants:
+                localizations_dict_update = {
+                    for_language: {
+                        "stringUnit": {
+                            "state": "translated",
+                            "value": substitute(translation, values)
+                        }
                     }
                 }
-            }
 
-            if "localizations" in self.info_dict:
-                self.info_dict["localizations"].update(localizations_dict_update)
-            else:
-                self.info_dict["localizations"] = localizations_dict_update
+                if "localizations" in info_dict:
+                    info_dict["localizations"].update(localizations_dict_update)
+                else:
+                    info_dict["localizations"] = localizations_dict_update
             return True
         except:
             return False
@@ -99,6 +215,41 @@ class TranslateL10nConfig:
     output_path: str
     log_path: str
     update_existing: bool
+    # Fingerprints of the existing translations are read from here ...
+    fingerprints_path: str = None
+    # ... and the updated fingerprints are written here.
+    output_fingerprints_path: str = None
+    profile: bool = False
+    profile_cprofile: bool = False
+    hedge_percentile: float = None
+    hedge_max_ratio: float = 0.1
+    max_retries: int = 6
+    # Responses are recorded to or replayed from these files, see transport.py
+    record_path: str = None
+    replay_path: str = None
+    replay_fall_through: bool = False
+    # Stop sending new batches after this many seconds or tokens. The strings
+    # are sent in order of priority, see priorities.py.
+    deadline_sec: float = None
+    budget_tokens: int = None
+    # Strings used in .swift files below swift_root that changed within the
+    # last recent_days are translated before other translations are updated.
+    swift_root: str = None
+    recent_days: float = 14
+
+
+class TranslationStopped(L10nError):
+    """
+    Raised by translate_strings if the deadline passed or the budget was used
+    up. The batches that were completed until then are already added to the
+    catalog and the fingerprints.
+
+    translated: The Translatables that were translated.
+    """
+
+    def __init__(self, message: str, kind: str, translated: List["Translatable"]):
+        super().__init__(message, kind=kind)
+        self.translated = translated
 
 
 def _parse_args():
@@ -107,7 +258,11 @@ def _parse_args():
     parser.add_argument("target_language", help="ISO 639-1 Code if the language has one, otherwise use ISO 639-2 Code")
     parser.add_argument("localizable_path", help="Path to a Localizable.xcstrings. If no file is given, the sub folders of the given folder will be searched for this file.")
     parser.add_argument("--output", type=str, help="Optional output folder. The Localizable.xcstrings file will not be overwritten and the modified version will be placed in the given folder.")
-    parser.add_argument("--update-existing", action="store_true", help="If this optional flag is set, terms for which a translation already exists will be overwritten with newly queried translations.")
+    parser.add_argument("--update-existing", action="store_true", help="If this optional flag is set, terms for which a translation already exists will be overwritten with newly queried translations. Without it, only missing translations and those whose source string, comment, app context or prompt changed are queried.")
+    parser.add_argument("--deadline", type=float, default=None, metavar="SECONDS", help="Stop sending new queries after this many seconds and save what was translated so far. The most important strings are translated first.")
+    parser.add_argument("--budget", type=int, default=None, metavar="TOKENS", help="Stop sending new queries once this many tokens were used and save what was translated so far.")
+    parser.add_argument("--swift-root", type=str, default=None, help="Optional folder with the app's .swift files. Strings used in recently changed files are translated before other strings that already have a translation.")
+    parser.add_argument("--recent-days", type=float, default=14, help="Files below --swift-root that changed within this many days count as recently changed.")
     add_common_args(parser)
 
     args = parser.parse_args()
@@ -142,120 +297,229 @@ def _parse_args():
         openai_api_cooldown = args.openai_api_cooldown,
         output_path = output_filepath,
         log_path = args.log_path,
-        update_existing=args.update_existing
+        update_existing=args.update_existing,
+        fingerprints_path = get_fingerprints_path(localizable_filepath),
+        output_fingerprints_path = get_fingerprints_path(output_filepath),
+        profile = args.profile,
+        profile_cprofile = args.profile_cprofile,
+        hedge_percentile = args.hedge_percentile,
+        hedge_max_ratio = args.hedge_max_ratio,
+        max_retries = args.max_retries,
+        record_path = args.record,
+        replay_path = args.replay,
+        replay_fall_through = args.replay_fall_through,
+        deadline_sec = args.deadline,
+        budget_tokens = args.budget,
+        swift_root = args.swift_root,
+        recent_days = args.recent_days
     )
 
     return conf
 
 
-def build_gpt_translatable_objects(conf: TranslateL10nConfig, strings_dict: Dict[str, any]) -> List[Translatable]:
+def build_gpt_translatable_objects(conf: TranslateL10nConfig, strings_dict: Dict[str, any], fingerprints: Dict[str, str] = None, app_context: str = None,
+                                   source_language: str = None, recent_keys: Set[str] = None) -> List[Translatable]:
     """
     Parses the Localizable.xcstrings file and constructs a Translatable object
-    for each string in this file. If a string does not have a translation or if
-    the user wants to redo all translations, it will be added to the returned
-    list.
+    for each string in this file. If a string does not have an up-to-date
+    translation (see Translatable.is_translated_to) or if the user wants to
+    redo all translations, it will be added to the returned list. Strings that
+    only differ in numbers or format specifiers and have the same comment are
+    grouped into a single Translatable.
+
+    The list is ordered by priority (see priorities.translation_priority) and
+    otherwise keeps the order of the catalog.
+
+    fingerprints: {key: fingerprint} of the existing target language translations.
+    recent_keys: Strings of recently changed Swift files, see priorities.collect_referenced_keys.
     """
-    objects_in_this_query: List[Translatable] = []
+    fingerprints = fingerprints or {}
+    # Keyed by (template, comment), strings used in different places keep their own comment
+    objects_by_template: Dict[Tuple[str, str], Translatable] = {}
 
     for key in strings_dict.keys():
         string_info = strings_dict[key]
-        translatable = Translatable(key, string_info)
+        translatable = Translatable(key, string_info, app_context)
 
-        if not translatable.is_translated_to(conf.target_language) or conf.update_existing:
-            objects_in_this_query.append(translatable)
+        if translatable.is_translated_to(conf.target_language, fingerprints.get(key)) and not conf.update_existing:
+            continue
+
+        translatable.priority = translation_priority(key, string_info, conf.target_language, source_language, recent_keys)
+
+        group = (translatable.template, string_info.get("comment"))
+        if group in objects_by_template:
+            objects_by_template[group].add_variant(translatable)
+        else:
+            objects_by_template[group] = translatable
 
-    return objects_in_this_query
+    return sorted(objects_by_template.values(), key=lambda t: t.priority)
     
 
-def get_gpt_response(conf: TranslateL10nConfig, translatable_objs: List[Translatable], source_lang: str):
-    chatgpt_token = get_openapi_token()
-    app_context = get_app_context()
-    task_desc = get_task_desc(source_lang, conf.target_language)
+def create_chat_gpt(conf: TranslateL10nConfig, transport: RecordReplayTransport = None) -> ChatGPT:
+    chatgpt_token = get_openapi_token(required=transport is None or not transport.is_offline)
 
     print("Init ChatGPT with token: ", chatgpt_token)
 
-    cpt = ChatGPT(chatgpt_token, model="gpt-4o", log_path=conf.log_path, cooldown_duration_sec=conf.openai_api_cooldown)
+    hedging = HedgingPolicy(conf.hedge_percentile, conf.hedge_max_ratio) if conf.hedge_percentile else None
+    budget = UsageBudget(max_tokens=conf.budget_tokens) if conf.budget_tokens is not None else None
+    return ChatGPT(chatgpt_token, model="gpt-4o", log_path=conf.log_path, cooldown_duration_sec=conf.openai_api_cooldown, hedging=hedging,
+                   retry_policy=RetryPolicy(max_retries=conf.max_retries), budget=budget, transport=transport)
+
+
+def iter_gpt_responses(cpt: ChatGPT, translatable_objs: List[Translatable], source_lang: str, target_lang: str,
+                       app_context: str = None, deadline: float = None) -> Iterator[Tuple[List[Translatable], str]]:
+    """
+    Queries the translations in batches and yields (batch, response) after
+    each query. No further queries are sent if the caller stops iterating.
+
+    deadline: See ChatGPT.complete_query.
+    """
+    system_cmd = build_translation_system_command(source_lang, target_lang, app_context)
 
     # Max query length depends on the model. For gpt-3.5, using 30 strings in a query was too much.
     max_query_length = 10
-    full_response = ""
 
-    for i in range(0, len(translatable_objs)-1, max_query_length):
+    for i in range(0, len(translatable_objs), max_query_length):
 
         query_idx = int(i/max_query_length + 1)
 
-        query_lines = [t.get_gpt_query() for t in translatable_objs[i: i+max_query_length]]
+        batch_objs = translatable_objs[i: i+max_query_length]
+        query_lines = [t.get_gpt_query() for t in batch_objs]
         query_length = len(query_lines)
         query = "\n".join(query_lines)
 
-        print(f"running gpt query number {query_idx} with {query_length} strings")
+        logger.info(f"running gpt query number {query_idx} with {query_length} strings")
 
         def is_response_valid_callback(response: str):
             non_empty_lines = [l for l in response.split("\n") if l]
             valid = len(non_empty_lines) == query_length
-            valid &= all([line.startswith("translation: ") for line in non_empty_lines])
+            valid = valid and all([t.is_valid_gpt_response(line) for t, line in zip(batch_objs, non_empty_lines)])
             return valid
-            
-        system_cmd = task_desc
-        if app_context:
-            system_cmd += "\n" + app_context
 
-        response = cpt.complete_query(system_cmd, query, is_response_valid_callback)
-        full_response += response + "\n"
-    
-    return full_response
+        with span("translate_batch", batch=query_idx, strings=query_length):
+            response = cpt.complete_query(system_cmd, query, is_response_valid_callback, deadline=deadline)
+        yield batch_objs, response
 
 
-def evaluate_response(full_response: str, translatable_objects: List[Translatable], target_lang: str):
+def evaluate_response(response: str, translatable_objects: List[Translatable], target_lang: str):
     """
-    Parses the response for the translated strings and 
+    Parses the response for the translated strings and adds the translations
+    to the Translatables' info dicts. Raises L10nError if the response does not
+    match the requested strings.
     """
     valid_lines = 0
-    valid_response = True
 
-    for line in full_response.split("\n"):
+    for line in response.split("\n"):
         if not line:
             continue
-        
-        valid_response &= translatable_objects[valid_lines].parse_gpt_response(line, for_language=target_lang)
 
-        if not valid_response:
-            print("invalid line")
-            print(line)
-            exit(1)
+        if valid_lines >= len(translatable_objects) or \
+                not translatable_objects[valid_lines].parse_gpt_response(line, for_language=target_lang):
+            raise L10nError(f"invalid line\n{line}", kind="invalid_response")
 
         valid_lines += 1
 
     if valid_lines != len(translatable_objects):
-        print(f"Something went wrong. {len(translatable_objects)} translations were requested but only {valid_lines} were parsed.")
-        print("Aborting.")
-        exit(1)
-    
+        raise L10nError(f"Something went wrong. {len(translatable_objects)} translations were requested but only {valid_lines} were parsed.", kind="invalid_response")
 
-def main():
 
-    conf = _parse_args()
-
-    with open(conf.localizable_path, "r") as f:
-        loc = json.loads(f.read())
-    
+def translate_strings(cpt: ChatGPT, loc: Dict[str, any], conf: TranslateL10nConfig, fingerprints: Dict[str, Dict[str, str]], app_context: str = None) -> List[Translatable]:
+    """
+    Adds translations for conf.target_language to the parsed catalog loc in
+    place and updates fingerprints ({language: {key: fingerprint}})
+    accordingly. Returns the Translatables that were translated.
+
+    The strings are sent in order of priority and each batch is added as soon
+    as its response arrives. If conf.deadline_sec passes (or would pass while
+    waiting for the rate limit) or the budget of cpt is used up,
+    TranslationStopped is raised instead of sending the next batch.
+    """
+    deadline = time.time() + conf.deadline_sec if conf.deadline_sec is not None else None
     source_lang = loc["sourceLanguage"]
     target_lang = conf.target_language
     
-    print("Source language found: " + source_lang)
+    logger.info("Source language found: " + source_lang)
+
+    recent_keys = None
+    if conf.swift_root:
+        with span("collect_recent_keys") as recent_span:
+            recent_files = find_recently_changed_swift_files(conf.swift_root, conf.recent_days)
+            recent_keys = collect_referenced_keys(recent_files)
+            recent_span.annotate(files=len(recent_files))
     
     strings_dict = loc["strings"]
-    translatable_objects = build_gpt_translatable_objects(conf, strings_dict)
+    with span("build_translatables", strings=len(strings_dict)) as build_span:
+        lang_fingerprints = fingerprints.setdefault(target_lang, {})
+        translatable_objects = build_gpt_translatable_objects(conf, strings_dict, lang_fingerprints, app_context, source_lang, recent_keys)
+        build_span.annotate(translatables=len(translatable_objects))
+
+    priority_counts = collections.Counter(t.priority for t in translatable_objects)
+    logger.info("Strings to translate: " + ", ".join(f"{priority_counts[p]} {name}" for p, name in PRIORITY_NAMES.items()))
+
+    translated: List[Translatable] = []
+    try:
+        for batch_objs, response in iter_gpt_responses(cpt, translatable_objects, source_lang, target_lang, app_context, deadline):
+            with span("evaluate_response"):
+                evaluate_response(response, batch_objs, target_lang)
+
+            for translatable in batch_objs:
+                for key, _, _, fingerprint in translatable.variants:
+                    lang_fingerprints[key] = fingerprint
+            translated.extend(batch_objs)
+    except DeadlineExceededError:
+        raise TranslationStopped(f"Deadline reached after translating {len(translated)} of {len(translatable_objects)} strings.",
+                                 "deadline", translated) from None
+    except BudgetExhaustedError:
+        raise TranslationStopped(f"Budget used up after translating {len(translated)} of {len(translatable_objects)} strings.",
+                                 "budget_exhausted", translated) from None
+
+    return translated
 
-    ## send to chatGPT
-    full_response = get_gpt_response(conf, translatable_objects, source_lang)
-    
-    ## evaluate response
-    evaluate_response(full_response, translatable_objects, target_lang)
+
+def main():
+
+    log_to_stdout()
+    conf = _parse_args()
+
+    with profiling(conf.profile, conf.log_path, conf.profile_cprofile):
+        try:
+            translate(conf)
+        except L10nError as e:
+            print(e.message)
+            print("Aborting.")
+            exit(1)
+
+
+def translate(conf: TranslateL10nConfig):
+
+    with span("load_catalog"):
+        with open(conf.localizable_path, "r") as f:
+            loc = json.loads(f.read())
+
+    fingerprints = load_fingerprints(conf.fingerprints_path) if conf.fingerprints_path else {}
+
+    transport = create_transport(conf.record_path, conf.replay_path, conf.replay_fall_through)
+    try:
+        cpt = create_chat_gpt(conf, transport)
+        try:
+            translate_strings(cpt, loc, conf, fingerprints, get_app_context())
+        except TranslationStopped as e:
+            # Keep what was translated so far, the rest is picked up by the next run
+            print(e.message)
+            print("Saving the translations so far. Run again to translate the remaining strings.")
+        print("Usage: " + cpt.usage.summary())
+    finally:
+        if transport is not None:
+            print(transport.summary())
+            transport.close()
     
     ## write back to json
-    with open(conf.output_path, "w") as f:
-        f.write(json.dumps(loc, indent=2, separators=(', ', ' : '), ensure_ascii=False))
+    with span("write_catalog"):
+        with open(conf.output_path, "w") as f:
+            f.write(json.dumps(loc, indent=2, separators=(', ', ' : '), ensure_ascii=False))
+
+        if conf.output_fingerprints_path:
+            save_fingerprints(conf.output_fingerprints_path, fingerprints)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+
+#
+# Marius Montebaur
+#
+# October 2023
+#
+# Record/replay transport for ChatGPT. In record mode, every completion is
+# stored together with a fingerprint of its request. In replay mode, requests
+# with a known fingerprint are answered from the store without contacting the
+# API, so whole runs of the scripts can be repeated offline, e.g. after a
+# change to the parser or to compare timings.
+#
+# The store is a text file with one "<fingerprint>\t<json>" line per response.
+# Only the fingerprints and line offsets are kept in memory.
+#
+
+
+import os
+import json
+import hashlib
+import threading
+from types import SimpleNamespace
+from typing import Dict, List
+
+from common import L10nError
+
+
+RECORD = "record"
+REPLAY = "replay"
+
+
+class ReplayMissError(L10nError):
+
+    def __init__(self, message: str):
+        super().__init__(message, kind="replay_miss")
+
+
+def request_fingerprint(model: str, messages: List[Dict[str, str]]) -> str:
+    sha = hashlib.sha256()
+    sha.update(json.dumps({"model": model, "messages": messages}, sort_keys=True, ensure_ascii=False).encode("utf-8"))
+    return sha.hexdigest()
+
+
+class ResponseStore:
+    """
+    Append-only store of responses, indexed by request fingerprint. A request
+    can be stored several times (e.g. a retry after an invalid response), in
+    which case the responses are kept in the order they were recorded.
+    """
+
+    def __init__(self, path: str, truncate: bool = False):
+        self.path = path
+        self._lock = threading.Lock()
+        self._offsets: Dict[str, List[int]] = {}
+
+        folder = os.path.dirname(os.path.abspath(path))
+        os.makedirs(folder, exist_ok=True)
+        self._file = open(path, "w+b" if truncate else "a+b")
+        self._build_index()
+
+    def _build_index(self):
+        self._file.seek(0)
+        offset = 0
+        for line in self._file:
+            fingerprint, _, _ = line.partition(b"\t")
+            self._offsets.setdefault(fingerprint.decode("ascii"), []).append(offset)
+            offset += len(line)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(offsets) for offsets in self._offsets.values())
+
+    def count(self, fingerprint: str) -> int:
+        with self._lock:
+            return len(self._offsets.get(fingerprint, []))
+
+    def get(self, fingerprint: str, index: int = 0) -> Dict:
+        """
+        Returns the index-th response that was stored for fingerprint or None.
+        """
+        with self._lock:
+            offsets = self._offsets.get(fingerprint)
+            if not offsets or index >= len(offsets):
+                return None
+            self._file.seek(offsets[index])
+            line = self._file.readline()
+
+        _, _, record = line.partition(b"\t")
+        return json.loads(record)
+
+    def append(self, fingerprint: str, record: Dict):
+        line = fingerprint.encode("ascii") + b"\t" + json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n"
+        with self._lock:
+            self._file.seek(0, os.SEEK_END)
+            offset = self._file.tell()
+            self._file.write(line)
+            self._file.flush()
+            self._offsets.setdefault(fingerprint, []).append(offset)
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def _response_to_record(response) -> Dict:
+    choice = response.choices[0]
+    usage = response.usage
+    details = getattr(usage, "prompt_tokens_details", None)
+    return {
+        "finish_reason": choice.finish_reason,
+        "content": choice.message.content,
+        "usage": {
+            "prompt_tokens": usage.prompt_tokens if usage else 0,
+            "completion_tokens": usage.completion_tokens if usage else 0,
+            "cached_tokens": (getattr(details, "cached_tokens", None) or 0) if details else 0,
+        },
+    }
+
+
+def _record_to_response(record: Dict):
+    """
+    Rebuilds the parts of an openai ChatCompletion that ChatGPT uses.
+    """
+    usage = record["usage"]
+    return SimpleNamespace(
+        choices=[SimpleNamespace(finish_reason=record["finish_reason"], message=SimpleNamespace(content=record["content"]))],
+        usage=SimpleNamespace(
+            prompt_tokens=usage["prompt_tokens"],
+            completion_tokens=usage["completion_tokens"],
+            prompt_tokens_details=SimpleNamespace(cached_tokens=usage["cached_tokens"])
+        )
+    )
+
+
+class RecordReplayTransport:
+    """
+    Sits between ChatGPT and the API.
+
+    record: Every response from the API is written to a fresh store.
+    replay: Requests are answered from the store. A request that was stored
+        several times gets the stored responses in order, the last one is
+        repeated. On a miss, ReplayMissError is raised, unless fall_through
+        is set. Then the request is sent to the API and its response is added
+        to the store.
+    """
+
+    def __init__(self, path: str, mode: str, fall_through: bool = False):
+        if mode not in (RECORD, REPLAY):
+            raise ValueError(f"Unknown transport mode {mode}, expected '{RECORD}' or '{REPLAY}'.")
+
+        self.mode = mode
+        self.fall_through = fall_through
+        self.store = ResponseStore(path, truncate=mode == RECORD)
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        # Number of times each fingerprint was replayed in this run
+        self._replay_counts: Dict[str, int] = {}
+
+    @property
+    def is_offline(self) -> bool:
+        """
+        True if the API is never contacted.
+        """
+        return self.mode == REPLAY and not self.fall_through
+
+    def replay(self, model: str, messages: List[Dict[str, str]]):
+        """
+        Returns the stored response for the request or None if it should be
+        sent to the API.
+        """
+        if self.mode != REPLAY:
+            return None
+
+        fingerprint = request_fingerprint(model, messages)
+        stored = self.store.count(fingerprint)
+        with self._lock:
+            index = self._replay_counts.get(fingerprint, 0)
+            if stored:
+                self._replay_counts[fingerprint] = index + 1
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if not stored:
+            if self.fall_through:
+                return None
+            raise ReplayMissError(f"No recorded response for request {fingerprint[:12]} in {self.store.path}.")
+
+        return _record_to_response(self.store.get(fingerprint, min(index, stored - 1)))
+
+    def record(self, model: str, messages: List[Dict[str, str]], response):
+        """
+        Stores a response that was returned by the API.
+        """
+        self.store.append(request_fingerprint(model, messages), _response_to_record(response))
+
+    def summary(self) -> str:
+        if self.mode == RECORD:
+            return f"Recorded {len(self.store)} responses to {self.store.path}."
+        return f"Replayed {self.hits} responses from {self.store.path}, {self.misses} misses."
+
+    def close(self):
+        self.store.close()
+
+
+def create_transport(record_path: str = None, replay_path: str = None, fall_through: bool = False) -> RecordReplayTransport:
+    """
+    Builds the transport for the --record / --replay command line arguments.
+    Returns None if neither is given.
+    """
+    if record_path and replay_path:
+        raise L10nError("Only one of --record and --replay can be given.", kind="usage")
+    if record_path:
+        return RecordReplayTransport(record_path, RECORD)
+    if replay_path:
+        if not fall_through and not os.path.exists(replay_path):
+            raise L10nError(f"Replay file not found: {replay_path}", kind="usage", path=replay_path)
+        return RecordReplayTransport(replay_path, REPLAY, fall_through)
+    return None